@@ -1,11 +1,16 @@
 
 import os
 import asyncio
+import atexit
 import json
 import logging
+import queue
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from dotenv import load_dotenv
 import uvicorn
 from pydantic import BaseModel
@@ -23,28 +28,65 @@ from session_manager import SessionManager
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
+# Configure logging: records go through a queue so file/console I/O happens on a
+# background thread instead of the event loop
+def _setup_logging():
+    root_logger = logging.getLogger()
+    # `python main.py` imports this module twice (as __main__, then as uvicorn's
+    # "main:app"); a second handler/listener pair would write every line twice
+    if any(isinstance(h, QueueHandler) for h in root_logger.handlers):
+        return
+    log_queue = queue.Queue(-1)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [
         logging.FileHandler('app.log', encoding='utf-8'),
-        logging.StreamHandler()
+        logging.StreamHandler(),
     ]
-)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    # Not basicConfig: it would set a formatter on the QueueHandler and format records twice
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(QueueHandler(log_queue))
+
+_setup_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # All session websocket I/O runs on this loop: uvloop (picked by uvicorn's loop
+    # "auto"/"uvloop" when installed) is markedly faster than the stdlib loop
+    loop_type = type(asyncio.get_running_loop())
+    if loop_type.__module__.startswith("uvloop"):
+        logger.info("⚡ Event loop: uvloop")
+    else:
+        logger.warning(
+            f"⚠️ Event loop: {loop_type.__module__}.{loop_type.__name__}"
+            " (install uvloop for faster websocket I/O)"
+        )
+    yield
+    # Close the shared httpx client, the Redis pool and the pooled STT connections
+    await ai_agent.aclose()
+    await stt_service.close()
+
+app = FastAPI(lifespan=lifespan)
 
-# CORS
+# CORS: any origin by default (the web FE, the Electron app and LAN hosts all talk to
+# this backend). Set CORS_ORIGINS to a comma-separated list to lock it down.
+CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=[o.strip() for o in CORS_ORIGINS if o.strip()],
+    allow_credentials=os.getenv("CORS_ALLOW_CREDENTIALS", "1") == "1",
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# Compress larger JSON responses (e.g. session history grows with the chat)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Mount Emoji Static Files
 EMOJI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "emoji")
 if os.path.exists(EMOJI_DIR):
@@ -77,19 +119,19 @@ async def root():
 @app.post("/api/clear-session/{session_id}")
 async def clear_session(session_id: str):
     """Clear chat history for a specific session"""
-    ai_agent.clear_session(session_id)
+    await ai_agent.clear_session(session_id)
     return {"message": f"Session {session_id} cleared"}
 
 @app.post("/api/clear-all-sessions")
 async def clear_all_sessions():
     """Clear all chat sessions"""
-    ai_agent.clear_all_sessions()
+    await ai_agent.clear_all_sessions()
     return {"message": "All sessions cleared"}
 
 @app.get("/api/session/{session_id}/history")
 async def get_session_history(session_id: str):
     """Get chat history for a specific session"""
-    history = ai_agent.get_session_history(session_id)
+    history = await ai_agent.get_session_history(session_id)
     return {"session_id": session_id, "history": history}
 
 @app.post("/api/tts")
@@ -146,4 +188,15 @@ async def websocket_endpoint(websocket: WebSocket):
         await session.cleanup()
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # loop/http "auto" pick uvloop + httptools when installed (uvloop is not available on Windows).
+    # Without REDIS_URL chat history lives in-process, so keep WEB_CONCURRENCY=1.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop="auto",
+        http="auto",
+        ws="websockets",
+        reload=os.getenv("RELOAD") == "1",
+    )
@@ -2,11 +2,83 @@ import os
 import re
 import logging
 from typing import Dict, List
-from collections import defaultdict
+import httpx
 from openai import AsyncOpenAI
 
+from services.session_store import create_session_store
+
 logger = logging.getLogger(__name__)
 
+# HTTP/2 needs the optional `h2` package (httpx[http2]); fall back to HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
+
+class _ThinkStripper:
+    """
+    Drops <think>...</think> blocks from streamed text wherever they occur,
+    holding back only the few chars that could be the start of a split tag.
+    """
+
+    OPEN = "<think>"
+    CLOSE = "</think>"
+
+    __slots__ = ("in_think", "tail", "after_close")
+
+    def __init__(self):
+        self.in_think = False
+        self.tail = ""
+        self.after_close = False  # drop whitespace right after </think>
+
+    def feed(self, token: str) -> str:
+        """Return the part of `token` outside think blocks"""
+        window = self.tail + token if self.tail else token
+        self.tail = ""
+        out = []
+        while window:
+            if self.in_think:
+                idx = window.find(self.CLOSE)
+                if idx < 0:
+                    # Keep enough to catch a closing tag split across tokens
+                    self.tail = window[-(len(self.CLOSE) - 1):]
+                    break
+                window = window[idx + len(self.CLOSE):]
+                self.in_think = False
+                self.after_close = True
+                continue
+            if self.after_close:
+                window = window.lstrip()
+                if not window:
+                    break
+                self.after_close = False
+            idx = window.find(self.OPEN)
+            if idx >= 0:
+                out.append(window[:idx])
+                window = window[idx + len(self.OPEN):]
+                self.in_think = True
+                continue
+            # Hold back a suffix that could still become "<think>"
+            keep = 0
+            for k in range(min(len(self.OPEN) - 1, len(window)), 0, -1):
+                if window.endswith(self.OPEN[:k]):
+                    keep = k
+                    break
+            if keep:
+                out.append(window[:-keep])
+                self.tail = window[-keep:]
+            else:
+                out.append(window)
+            break
+        return "".join(out)
+
+    def flush(self) -> str:
+        """At end of stream: held-back text that never became a tag"""
+        text, self.tail = ("" if self.in_think else self.tail), ""
+        return text
+
 
 class LLMAgent:
     """
@@ -14,6 +86,9 @@ class LLMAgent:
     Uses the `openai` Python SDK for both streaming and non-streaming chat completions.
     """
 
+    MAX_HISTORY = 20
+    _THINK_RE = re.compile(r'<think>.*?</think>', re.DOTALL)
+
     def __init__(self):
         self.base_url = os.getenv("LLM_API_URL", "https://chat.anm05.com/api")
         self.api_key = os.getenv("LLM_API_KEY", os.getenv("LITELLM_MASTER_KEY", ""))
@@ -23,10 +98,24 @@ class LLMAgent:
             "You also need to output an emotion tag at the start of your response like [HAPPY], [SAD], [NEUTRAL], [THINKING], [SURPRISED], [ANGRY]. "
             "Example: '[HAPPY] Hello! How can I help you today?'"
         )
-        # Store chat history per session
-        self.sessions: Dict[str, List[Dict[str, str]]] = defaultdict(list)
+        self._system_message = {"role": "system", "content": self.system_prompt}
+        # Opt-in prompt-cache hints so the backend can reuse the KV prefix across turns.
+        # Off by default: strict OpenAI-compatible servers reject the extra fields, and
+        # the session id is sent upstream as `user`
+        self.prompt_cache = os.getenv("LLM_PROMPT_CACHE", "0") == "1"
+        # Chat history per session (bounded to the last MAX_HISTORY messages),
+        # in Redis when REDIS_URL is set so every worker sees the same history
+        self.sessions = create_session_store(max_history=self.MAX_HISTORY)
         
-        # Initialize AsyncOpenAI client
+        # Shared HTTP transport: keep-alive pool (+ HTTP/2 multiplexing when available)
+        self._http = httpx.AsyncClient(
+            http2=HAS_HTTP2,
+            limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=60),
+            timeout=httpx.Timeout(60, connect=5),
+        )
+
+        # AsyncOpenAI clients keyed by (base_url, api_key), reused across model switches
+        self._clients: Dict[tuple, AsyncOpenAI] = {}
         self.client = None
         self.update_model(self.model)
         
@@ -34,10 +123,13 @@ class LLMAgent:
 
     def update_prompt(self, new_prompt: str):
         """Update the system prompt"""
+        if new_prompt == self.system_prompt:
+            return  # keep the cached prefix byte-identical
         self.system_prompt = new_prompt
+        self._system_message = {"role": "system", "content": new_prompt}
 
     def update_model(self, model_name: str):
-        """Update the AI model and recreate client if needed"""
+        """Update the AI model and switch client if the endpoint changed"""
         self.model = model_name
         
         if "gemini" in self.model.lower():
@@ -47,39 +139,46 @@ class LLMAgent:
             self.base_url = os.getenv("LLM_API_URL", "https://chat.anm05.com/api")
             self.api_key = os.getenv("LLM_API_KEY", os.getenv("LITELLM_MASTER_KEY", ""))
             
-        self.client = AsyncOpenAI(
-            base_url=self.base_url,
-            api_key=self.api_key,
-        )
+        key = (self.base_url, self.api_key)
+        client = self._clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                http_client=self._http,
+            )
+            self._clients[key] = client
+        self.client = client
         logger.info(f"🤖 AI model updated to: {model_name}, api_base={self.base_url}")
 
-    def get_session_history(self, session_id: str) -> List[Dict[str, str]]:
+    async def aclose(self):
+        """Close the shared HTTP transport and session store"""
+        # All cached clients share self._http, closing it closes them too
+        self._clients.clear()
+        await self._http.aclose()
+        await self.sessions.close()
+
+    async def get_session_history(self, session_id: str) -> List[Dict[str, str]]:
         """Get chat history for a session"""
-        return self.sessions[session_id]
+        return await self.sessions.get(session_id)
 
-    def clear_session(self, session_id: str):
+    async def clear_session(self, session_id: str):
         """Clear chat history for a session"""
-        if session_id in self.sessions:
-            self.sessions[session_id] = []
+        if await self.sessions.clear(session_id):
             logger.info(f"Cleared session: {session_id}")
 
-    def clear_all_sessions(self):
+    async def clear_all_sessions(self):
         """Clear all chat sessions"""
-        self.sessions.clear()
+        await self.sessions.clear_all()
         logger.info("Cleared all sessions")
 
-    def _build_messages(self, session_id: str, user_message: str) -> List[Dict[str, str]]:
+    async def _build_messages(self, session_id: str, user_message: str) -> List[Dict[str, str]]:
         """Build messages array with system prompt and chat history"""
-        messages = []
-        
-        # Add system prompt as first message
-        messages.append({
-            "role": "system",
-            "content": self.system_prompt
-        })
+        # System prompt first; the same dict is reused until the prompt changes
+        messages = [self._system_message]
         
         # Add chat history
-        messages.extend(self.sessions[session_id])
+        messages.extend(await self.sessions.get(session_id))
         
         # Add current user message
         messages.append({
@@ -89,39 +188,47 @@ class LLMAgent:
         
         return messages
 
-    def _add_to_history(self, session_id: str, role: str, content: str):
-        """Add a message to session history"""
-        self.sessions[session_id].append({
-            "role": role,
-            "content": content
-        })
-        
-        # Limit history to last 20 messages to prevent memory issues
-        if len(self.sessions[session_id]) > 20:
-            self.sessions[session_id] = self.sessions[session_id][-20:]
+    async def _add_to_history(self, session_id: str, user_text: str, assistant_text: str):
+        """Add a user/assistant exchange to session history"""
+        await self.sessions.append(
+            session_id,
+            {"role": "user", "content": user_text},
+            {"role": "assistant", "content": assistant_text},
+        )
 
-    @staticmethod
-    def _strip_think(text: str) -> str:
+    def _cache_kwargs(self, session_id: str) -> Dict:
+        """Extra request fields that pin a session to the same prompt-cache slot"""
+        # OpenAI-compatible (vLLM / LiteLLM / llama-server) fields only; Gemini's
+        # endpoint rejects unknown keys
+        if not self.prompt_cache or "gemini" in self.model.lower():
+            return {}
+        return {
+            "user": session_id,
+            "extra_body": {"cache_prompt": True, "prompt_cache_key": session_id},
+        }
+
+    @classmethod
+    def _strip_think(cls, text: str) -> str:
         """Remove <think>...</think> blocks from Qwen3 model output"""
-        return re.sub(r'<think>[\s\S]*?</think>', '', text).strip()
+        return cls._THINK_RE.sub('', text).strip()
 
     async def process(self, text: str, session_id: str = "default"):
         """Process text and return full response (non-streaming)"""
         try:
-            messages = self._build_messages(session_id, text)
+            messages = await self._build_messages(session_id, text)
             
             response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=0.7,
+                **self._cache_kwargs(session_id),
             )
             
             assistant_message = response.choices[0].message.content or ""
             assistant_message = self._strip_think(assistant_message)
             
             if assistant_message:
-                self._add_to_history(session_id, "user", text)
-                self._add_to_history(session_id, "assistant", assistant_message)
+                await self._add_to_history(session_id, text, assistant_message)
             
             return assistant_message
                 
@@ -131,54 +238,50 @@ class LLMAgent:
 
     async def process_stream(self, text: str, session_id: str = "default"):
         """Process text and stream response chunks using OpenAI streaming API.
-        Strips <think>...</think> blocks from Qwen3 output before yielding."""
-        full_response = ""
-        in_think_block = False
-        think_ended = False
+        Strips <think>...</think> blocks from Qwen3 output before yielding.
+
+        Tags are detected incrementally, anywhere in the output: only the new
+        token plus a short held-back tail is searched, so per-token work stays constant."""
+        parts: List[str] = []
+        think = _ThinkStripper()
         
         try:
-            messages = self._build_messages(session_id, text)
+            messages = await self._build_messages(session_id, text)
             
             stream = await self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=0.7,
                 stream=True,
+                **self._cache_kwargs(session_id),
             )
             
             async for chunk in stream:
-                if chunk.choices and len(chunk.choices) > 0:
-                    delta = chunk.choices[0].delta
+                if chunk.choices:
+                    choice = chunk.choices[0]
+                    delta = choice.delta
                     if delta and delta.content:
                         token = delta.content
-                        full_response += token
-                        
-                        # Skip tokens inside <think>...</think>
-                        if not think_ended:
-                            if '<think>' in full_response and not in_think_block:
-                                in_think_block = True
-                            if in_think_block:
-                                if '</think>' in full_response:
-                                    think_ended = True
-                                    # Extract content after </think>
-                                    after_think = full_response.split('</think>', 1)[1].strip()
-                                    if after_think:
-                                        yield after_think
-                                continue
-                        else:
-                            yield token
+                        parts.append(token)
+                        visible = think.feed(token)
+                        if visible:
+                            yield visible
                     
                     # Check for finish reason
-                    if chunk.choices[0].finish_reason is not None:
+                    if choice.finish_reason is not None:
                         break
             
+            # Flush text held back as a possible "<think>" prefix
+            rest = think.flush()
+            if rest:
+                yield rest
+            
             # Strip think block from full response for history
-            clean_response = self._strip_think(full_response)
+            clean_response = self._strip_think("".join(parts))
             
             # After streaming completes, add to history
             if clean_response:
-                self._add_to_history(session_id, "user", text)
-                self._add_to_history(session_id, "assistant", clean_response)
+                await self._add_to_history(session_id, text, clean_response)
                 
         except Exception as e:
             logger.error(f"AI Streaming Error: {e}")
@@ -0,0 +1,99 @@
+import os
+import json
+import logging
+from typing import Deque, Dict, List
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+
+class InMemorySessionStore:
+    """Per-process chat history, bounded to the last `max_history` messages per session"""
+
+    def __init__(self, max_history: int = 20):
+        self.max_history = max_history
+        self._sessions: Dict[str, Deque[Dict[str, str]]] = defaultdict(
+            lambda: deque(maxlen=self.max_history)
+        )
+
+    async def get(self, session_id: str) -> List[Dict[str, str]]:
+        if session_id not in self._sessions:
+            return []
+        return list(self._sessions[session_id])
+
+    async def append(self, session_id: str, *messages: Dict[str, str]):
+        # deque(maxlen) evicts the oldest message in place
+        self._sessions[session_id].extend(messages)
+
+    async def clear(self, session_id: str) -> bool:
+        if session_id not in self._sessions:
+            return False
+        self._sessions[session_id].clear()
+        return True
+
+    async def clear_all(self):
+        self._sessions.clear()
+
+    async def close(self):
+        pass
+
+
+class RedisSessionStore:
+    """
+    Chat history shared across workers.
+    Each session is a Redis LIST `chat:{session_id}` of JSON messages, trimmed to
+    the last `max_history` entries and expiring after `ttl` seconds of inactivity.
+    """
+
+    KEY_PREFIX = "chat:"
+
+    def __init__(self, url: str, max_history: int = 20, ttl: int = 3600):
+        import redis.asyncio as redis
+
+        self.max_history = max_history
+        self.ttl = ttl
+        self._redis = redis.from_url(url, decode_responses=True)
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.KEY_PREFIX}{session_id}"
+
+    async def get(self, session_id: str) -> List[Dict[str, str]]:
+        items = await self._redis.lrange(self._key(session_id), 0, -1)
+        return [json.loads(item) for item in items]
+
+    async def append(self, session_id: str, *messages: Dict[str, str]):
+        key = self._key(session_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *(json.dumps(m, ensure_ascii=False) for m in messages))
+            pipe.ltrim(key, -self.max_history, -1)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def clear(self, session_id: str) -> bool:
+        return bool(await self._redis.delete(self._key(session_id)))
+
+    async def clear_all(self):
+        keys = [key async for key in self._redis.scan_iter(match=f"{self.KEY_PREFIX}*")]
+        if keys:
+            await self._redis.delete(*keys)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_session_store(max_history: int = 20):
+    """Use Redis when REDIS_URL is set, otherwise keep history in-process"""
+    url = os.getenv("REDIS_URL")
+    if url:
+        try:
+            store = RedisSessionStore(
+                url,
+                max_history=max_history,
+                ttl=int(os.getenv("SESSION_TTL", "3600")),
+            )
+            logger.info("🗄️ Session store: Redis")
+            return store
+        except ImportError:
+            logger.error("❌ REDIS_URL is set but the `redis` package is not installed")
+    logger.info("🗄️ Session store: in-memory")
+    return InMemorySessionStore(max_history=max_history)
@@ -1,15 +1,43 @@
 import os
 import re
 import asyncio
-import io
+import mmap
+import struct
 import logging
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import soundfile as sf
 
 logger = logging.getLogger(__name__)
 
+# Sentence terminators (kept as separate items by split) and leading [EMOTION] tag
+_SENT_SPLIT = re.compile(r'([.!?。！？]+)')
+_TAG_STRIP = re.compile(r'^\[[^\]]+\]\s*')
+
+
+def _read_audio_file(path):
+    """Read a Gradio result file via a read-only mmap (single copy, no buffered reads)"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[:]
+
+def _pcm16_to_wav(pcm, sr):
+    """Wrap mono PCM16 little-endian samples in a 44-byte RIFF/WAVE header"""
+    header = struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + len(pcm), b'WAVE',
+        b'fmt ', 16, 1, 1, sr, sr * 2, 2, 16,
+        b'data', len(pcm),
+    )
+    return header + pcm
+
 class TextToSpeechService:
+    # Sentences synthesized concurrently ahead of the one being yielded
+    STREAM_PREFETCH = 3
+
     def __init__(self, tts_engine="vieneu"):
         self.tts_engine = "vieneu"
         self.vieneu_tts = None
@@ -19,6 +47,17 @@ class TextToSpeechService:
         self.normalizer = None
         self.default_voice = "Ngọc (nữ miền Bắc)"  # changeable at runtime
 
+        # Dedicated pool so blocking Gradio calls don't starve the default executor,
+        # plus a cap on in-flight requests to the TTS backend
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("TTS_WORKERS", "4")),
+            thread_name_prefix="tts",
+        )
+        self._sem = asyncio.Semaphore(int(os.getenv("TTS_INFLIGHT", "4")))
+
+        # Fallback audio is constant, build it once
+        self._beep_bytes = self._make_beep_bytes()
+
         if tts_engine == "vieneu" or tts_engine == "viterbox":
             # Try to initialize Gradio Client first (User Preference)
             self._init_gradio_client()
@@ -54,34 +93,26 @@ class TextToSpeechService:
     def update_tts_engine(self, engine: str):
         return
 
-    def _split_into_sentences(self, text):
-        """Split text into sentences for streaming TTS"""
-        clean_text = text
-        if text.startswith("[") and "]" in text:
-            end_idx = text.find("]")
-            clean_text = text[end_idx+1:].strip()
-        
-        sentences = re.split(r'([.!?。！？]+)', clean_text)
-        result = []
-        for i in range(0, len(sentences) - 1, 2):
-            if i + 1 < len(sentences):
-                sentence = sentences[i] + sentences[i + 1]
-                if sentence.strip():
-                    result.append(sentence.strip())
-        if len(sentences) % 2 == 1 and sentences[-1].strip():
-            result.append(sentences[-1].strip())
-        
+    def _split_into_sentences(self, clean_text):
+        """Split already-clean text (no emotion tag) into sentences for streaming TTS"""
+        parts = _SENT_SPLIT.split(clean_text)
+        pairs = ((body + punct).strip() for body, punct in zip(parts[::2], parts[1::2]))
+        result = [sentence for sentence in pairs if sentence]
+        if len(parts) % 2 == 1 and parts[-1].strip():
+            result.append(parts[-1].strip())
+
         if not result:
             return [clean_text] if clean_text else []
-        
+
         return result
 
-    async def synthesize(self, text, audio_prompt=None, language="vi"):
-        clean_text = text
-        if text.startswith("[") and "]" in text:
-            end_idx = text.find("]")
-            clean_text = text[end_idx+1:].strip()
-            
+    async def synthesize(self, text, audio_prompt=None, language="vi", strip_tag=True):
+        """Synthesize one piece of text to WAV bytes.
+        Pass strip_tag=False when the caller already removed the emotion tag."""
+        if not text or text.isspace():
+            return b""
+        clean_text = _TAG_STRIP.sub('', text).strip() if strip_tag else text.strip()
+
         if not clean_text:
             return b""
             
@@ -100,7 +131,7 @@ class TextToSpeechService:
                         if audio_prompt and isinstance(audio_prompt, str) and len(audio_prompt) < 100:
                             voice = audio_prompt
                         
-                        logger.info(f"📡 Calling VieNeu-TTS API for: '{clean_text[:20]}...' with voice '{voice}'")
+                        logger.debug(f"📡 Calling VieNeu-TTS API for: '{clean_text[:20]}...' with voice '{voice}'")
                         
                         # Call /synthesize_speech endpoint with required parameters
                         result = self.client.predict(
@@ -119,14 +150,9 @@ class TextToSpeechService:
                         )
                         
                         # Result is a tuple: (filepath, status_text)
-                        if isinstance(result, tuple) and len(result) >= 1:
-                            filepath = result[0]
-                            if isinstance(filepath, str) and os.path.exists(filepath):
-                                with open(filepath, "rb") as f:
-                                    return f.read()
-                        elif isinstance(result, str) and os.path.exists(result):
-                            with open(result, "rb") as f:
-                                return f.read()
+                        filepath = result[0] if isinstance(result, tuple) and result else result
+                        if isinstance(filepath, str) and os.path.exists(filepath):
+                            return _read_audio_file(filepath)
                                 
                     except Exception as api_err:
                         logger.error(f"❌ API call failed: {api_err}. Falling back to local if available.")
@@ -139,44 +165,65 @@ class TextToSpeechService:
                 logger.error(f"VieNeu synthesis error: {e}", exc_info=True)
                 return self._generate_beep()
                 
-        return await loop.run_in_executor(None, run_infer)
+        async with self._sem:
+            return await loop.run_in_executor(self._executor, run_infer)
 
     def _generate_beep(self):
+        return self._beep_bytes
+
+    @staticmethod
+    def _make_beep_bytes():
         sr = 24000
         t = np.linspace(0, 0.5, int(sr*0.5), endpoint=False)
-        wave = 0.5 * np.sin(2*np.pi*440*t).astype(np.float32)
-        buf = io.BytesIO()
-        sf.write(buf, wave, sr, format="WAV")
-        return buf.getvalue()
+        tone = 0.5 * np.sin(2*np.pi*440*t)
+        return _pcm16_to_wav((tone * 32767).astype('<i2').tobytes(), sr)
 
     async def synthesize_stream(self, text, stop_event=None):
-        clean_text = text
-        if text.startswith("[") and "]" in text:
-            end_idx = text.find("]")
-            clean_text = text[end_idx+1:].strip()
-        
-        if not clean_text:
+        """Yield audio per sentence, synthesizing up to STREAM_PREFETCH sentences ahead.
+        Chunks are yielded in sentence order."""
+        if not text or text.isspace():
             return
         
-        sentences = self._split_into_sentences(clean_text)
-        
-        for sentence in sentences:
-            if not sentence.strip():
-                continue
-            
-            if stop_event and stop_event.is_set():
-                logger.info("🛑 TTS stopped - user started speaking")
-                break
-            
-            try:
-                audio_chunk = await self.synthesize(sentence)
+        # Strip the emotion tag once here; sentences below go through with strip_tag=False
+        sentences = self._split_into_sentences(_TAG_STRIP.sub('', text).strip())
+        if not sentences:
+            return
+        sentences = iter(sentences)
+        pending = deque()  # (sentence, task) in submission order
+
+        def stopped():
+            return stop_event is not None and stop_event.is_set()
+
+        try:
+            while True:
+                # Keep the pipeline full so later sentences overlap with earlier ones
+                while len(pending) < self.STREAM_PREFETCH and not stopped():
+                    sentence = next(sentences, None)
+                    if sentence is None:
+                        break
+                    pending.append((sentence, asyncio.create_task(self.synthesize(sentence, strip_tag=False))))
+
+                if not pending:
+                    break
+
+                if stopped():
+                    logger.info("🛑 TTS stopped - user started speaking")
+                    break
+
+                sentence, task = pending.popleft()
+                try:
+                    audio_chunk = await task
+                except Exception as e:
+                    logger.error(f"TTS Error for sentence '{sentence}': {e}")
+                    continue
+
                 if audio_chunk:
-                    if stop_event and stop_event.is_set():
+                    if stopped():
                         logger.info("🛑 TTS stopped before sending chunk")
                         break
-                    
+
                     yield audio_chunk
-                    logger.info(f"🔊 Synthesized sentence audio chunk: {len(audio_chunk)} bytes")
-            except Exception as e:
-                logger.error(f"TTS Error for sentence '{sentence}': {e}")
-                continue
\ No newline at end of file
+                    logger.debug(f"🔊 Synthesized sentence audio chunk: {len(audio_chunk)} bytes")
+        finally:
+            for _, task in pending:
+                task.cancel()
@@ -1,15 +1,32 @@
 import asyncio
+import mmap
 import os
 import websockets
-import soundfile as sf
 import logging
 import io
 import numpy as np
-from typing import AsyncGenerator, Optional, Callable
+from typing import AsyncGenerator, Optional, Callable, Iterable, Union
 import json
 
+from services.stt import STT_WS_OPTIONS, pcm16_wav_data
+
+# orjson parses results 2-5x faster; stdlib json as fallback
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
 logger = logging.getLogger(__name__)
 
+BufferLike = Union[bytes, bytearray, memoryview, np.ndarray]
+
+def _lazy_sf():
+    """Import soundfile (and libsndfile) only when a fallback path needs it"""
+    import soundfile
+    return soundfile
+
+
 class StreamSTTService:
     """
     Streaming Speech-to-Text service using WebSocket connection
@@ -21,7 +38,7 @@ class StreamSTTService:
         ws_url: str = None,
         model: str = "large-v3",
         lang: str = "vi",
-        chunk_size: int = 4096
+        chunk_size: int = 8000
     ):
         """
         Initialize Stream STT Service
@@ -30,7 +47,10 @@ class StreamSTTService:
             ws_url: WebSocket URL for STT service
             model: Model to use (e.g., 'large-v3')
             lang: Language code (e.g., 'vi' for Vietnamese)
-            chunk_size: Size of audio chunks to send (in samples)
+            chunk_size: Size of audio chunks to send (in samples). Each chunk is one
+                WebSocket frame. The default of 8000 samples (500 ms, 16 KB) fits one
+                TLS record: larger chunks mean less per-frame overhead but a slightly
+                later first partial result.
         """
         self.ws_url = ws_url or os.getenv("STT_WS_URL", "wss://cahy-stt.anm05.com/stream")
         self.model = model
@@ -42,6 +62,129 @@ class StreamSTTService:
         """Build WebSocket connection URL with parameters"""
         return f"{self.ws_url}?model={self.model}&lang={self.lang}"
     
+    async def _send_batched(self, websocket, chunks):
+        """
+        Coalesce incoming audio pieces into WebSocket frames of at least one
+        `chunk_size` chunk (the last frame may be smaller), instead of one frame
+        per piece. Pieces may be any contiguous buffer (bytes, bytearray,
+        memoryview, numpy int16 array).
+        """
+        batch_bytes = self.chunk_size * 2  # int16 samples
+        buf = bytearray()
+        for chunk in chunks:
+            with memoryview(chunk) as mv, mv.cast("B") as piece:
+                if not buf and len(piece) >= batch_bytes:
+                    # Already a full frame: send it as-is
+                    await websocket.send(piece)
+                    continue
+                buf += piece
+            if len(buf) >= batch_bytes:
+                with memoryview(buf) as frame:
+                    await websocket.send(frame)
+                buf.clear()
+        if buf:
+            with memoryview(buf) as frame:
+                await websocket.send(frame)
+    
+    async def _send_buffer(self, websocket, pcm):
+        """
+        Send one contiguous PCM buffer as zero-copy memoryview slices,
+        one `chunk_size` chunk per frame.
+        """
+        step = self.chunk_size * 2  # int16 samples
+        # Every view is released on the way out, even when send raises, so an
+        # mmap'd `pcm` can still be closed
+        with memoryview(pcm) as raw, raw.cast("B") as mv:
+            for i in range(0, len(mv), step):
+                with mv[i:i + step] as frame:
+                    await websocket.send(frame)
+    
+    async def _send_wav_mmap(self, websocket, path: str) -> bool:
+        """
+        Send a 16 kHz mono PCM16 WAV straight from a read-only mmap of its data
+        chunk. Returns False (nothing sent) for any other format.
+        """
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                located = pcm16_wav_data(mm)
+                if located is None:
+                    return False
+                offset, length = located
+                logger.info(f"📁 Streaming WAV from mmap: {length // 2} samples at 16000Hz")
+                with memoryview(mm) as view, view[offset:offset + length] as data:
+                    await self._send_buffer(websocket, data)
+                return True
+    
+    async def _receive_results(
+        self,
+        websocket,
+        send_done: asyncio.Event,
+        on_message: Callable[[str], None],
+        final_timeout: float = 3.0,
+        on_final: Optional[Callable[[str], None]] = None
+    ):
+        """
+        Receive results while the sender runs. Once `send_done` is set, keep
+        receiving until the server has been quiet for `final_timeout` seconds;
+        with `on_final`, hand it the first result after the send instead and stop.
+        """
+        recv = None
+        send_wait = asyncio.ensure_future(send_done.wait())
+        try:
+            while True:
+                if recv is None:
+                    recv = asyncio.ensure_future(websocket.recv())
+                if send_done.is_set():
+                    done, _ = await asyncio.wait((recv,), timeout=final_timeout)
+                    if not done:
+                        logger.info("⏱️ No more STT results after send completed")
+                        return
+                    if on_final is not None:
+                        result = recv.result()
+                        recv = None
+                        on_final(result)
+                        return
+                else:
+                    done, _ = await asyncio.wait(
+                        (recv, send_wait), return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if recv not in done:
+                        continue  # send finished: switch to the quiet timeout
+                result = recv.result()
+                recv = None
+                on_message(result)
+        except websockets.exceptions.ConnectionClosed:
+            logger.info("🔌 WebSocket connection closed")
+        finally:
+            send_wait.cancel()
+            if recv is not None:
+                recv.cancel()
+    
+    async def _send_and_receive(
+        self,
+        websocket,
+        send,
+        on_message: Callable[[str], None],
+        final_timeout: float = 3.0,
+        on_final: Optional[Callable[[str], None]] = None
+    ):
+        """Run the `send` coroutine and a concurrent receiver, ending once results go
+        quiet (or, with `on_final`, at the first result after the send)"""
+        send_done = asyncio.Event()
+        
+        async def sender():
+            try:
+                await send
+            finally:
+                send_done.set()
+        
+        await asyncio.gather(
+            sender(),
+            self._receive_results(websocket, send_done, on_message, final_timeout, on_final)
+        )
+    
     async def stream_audio_file(
         self, 
         audio_file_path: str,
@@ -61,48 +204,36 @@ class StreamSTTService:
         uri = self.get_connection_url()
         
         try:
-            async with websockets.connect(uri) as websocket:
+            async with websockets.connect(uri, **STT_WS_OPTIONS) as websocket:
                 logger.info(f"✅ Connected to STT WebSocket: {uri}")
                 
-                # Read audio file
-                data, samplerate = sf.read(audio_file_path, dtype='int16')
-                logger.info(f"📁 Loaded audio: {len(data)} samples at {samplerate}Hz")
+                info_on = logger.isEnabledFor(logging.INFO)
                 
-                # Send audio in chunks
-                for i in range(0, len(data), self.chunk_size):
-                    chunk = data[i:i+self.chunk_size].tobytes()
-                    await websocket.send(chunk)
+                def handle(result):
+                    if info_on:
+                        logger.info("Received: %s", result)
+                    results.append(result)
                     
-                    # Try to receive response (non-blocking)
-                    try:
-                        result = await asyncio.wait_for(
-                            websocket.recv(), 
-                            timeout=0.01
-                        )
-                        logger.info(f"📝 Received: {result}")
-                        results.append(result)
-                        
-                        if on_result:
-                            on_result(result)
-                            
-                    except asyncio.TimeoutError:
-                        pass
+                    if on_result:
+                        on_result(result)
                 
-                # Wait for final results
-                try:
-                    while True:
-                        result = await asyncio.wait_for(
-                            websocket.recv(), 
-                            timeout=1.0
-                        )
-                        logger.info(f"📝 Final result: {result}")
-                        results.append(result)
+                async def send_audio():
+                    # 16 kHz mono PCM16 WAV is already the wire format: send from mmap
+                    sent = (
+                        audio_file_path.lower().endswith(".wav")
+                        and await self._send_wav_mmap(websocket, audio_file_path)
+                    )
+                    if not sent:
+                        # Read audio file
+                        data, samplerate = _lazy_sf().read(audio_file_path, dtype='int16')
+                        logger.info(f"📁 Loaded audio: {len(data)} samples at {samplerate}Hz")
                         
-                        if on_result:
-                            on_result(result)
-                            
-                except asyncio.TimeoutError:
-                    logger.info("⏱️ No more results, closing connection")
+                        # Send audio, one chunk per frame, straight from the array buffer
+                        await self._send_buffer(websocket, np.ascontiguousarray(data))
+                
+                # Send and receive concurrently, then wait for final results
+                # until the server has been quiet for 1 s
+                await self._send_and_receive(websocket, send_audio(), handle, final_timeout=1.0)
                     
         except Exception as e:
             logger.error(f"❌ Error in stream_audio_file: {e}")
@@ -131,49 +262,41 @@ class StreamSTTService:
         uri = self.get_connection_url()
         
         try:
-            async with websockets.connect(uri) as websocket:
+            async with websockets.connect(uri, **STT_WS_OPTIONS) as websocket:
                 logger.info(f"✅ Connected to STT WebSocket: {uri}")
                 
-                # Convert bytes to numpy array
-                audio_io = io.BytesIO(audio_data)
-                data, sr = sf.read(audio_io, dtype='int16')
-                logger.info(f"📁 Loaded audio: {len(data)} samples at {sr}Hz")
+                located = pcm16_wav_data(audio_data)
+                if located is not None:
+                    # 16 kHz mono PCM16 WAV is already the wire format: send its data chunk
+                    offset, length = located
+                    pcm = memoryview(audio_data)[offset:offset + length]
+                    logger.info(f"📁 Loaded audio: {length // 2} samples at 16000Hz")
+                else:
+                    # Convert bytes to numpy array
+                    audio_io = io.BytesIO(audio_data)
+                    data, sr = _lazy_sf().read(audio_io, dtype='int16')
+                    logger.info(f"📁 Loaded audio: {len(data)} samples at {sr}Hz")
+                    pcm = np.ascontiguousarray(data)
+                
+                info_on = logger.isEnabledFor(logging.INFO)
                 
-                # Send audio in chunks
-                for i in range(0, len(data), self.chunk_size):
-                    chunk = data[i:i+self.chunk_size].tobytes()
-                    await websocket.send(chunk)
+                def handle(result):
+                    if info_on:
+                        logger.info("Received: %s", result)
+                    results.append(result)
                     
-                    # Try to receive response (non-blocking)
-                    try:
-                        result = await asyncio.wait_for(
-                            websocket.recv(), 
-                            timeout=0.01
-                        )
-                        logger.info(f"📝 Received: {result}")
-                        results.append(result)
-                        
-                        if on_result:
-                            on_result(result)
-                            
-                    except asyncio.TimeoutError:
-                        pass
+                    if on_result:
+                        on_result(result)
                 
-                # Wait for final results
-                try:
-                    while True:
-                        result = await asyncio.wait_for(
-                            websocket.recv(), 
-                            timeout=1.0
-                        )
-                        logger.info(f"📝 Final result: {result}")
-                        results.append(result)
-                        
-                        if on_result:
-                            on_result(result)
-                            
-                except asyncio.TimeoutError:
-                    logger.info("⏱️ No more results, closing connection")
+                # Send audio, one chunk per frame, straight from the array buffer,
+                # while receiving concurrently; then wait for final results until
+                # the server has been quiet for 1 s
+                await self._send_and_receive(
+                    websocket,
+                    self._send_buffer(websocket, pcm),
+                    handle,
+                    final_timeout=1.0
+                )
                     
         except Exception as e:
             logger.error(f"❌ Error in stream_audio_bytes: {e}")
@@ -202,7 +325,7 @@ class StreamSTTService:
         send_done = asyncio.Event()
         
         try:
-            async with websockets.connect(uri) as websocket:
+            async with websockets.connect(uri, **STT_WS_OPTIONS) as websocket:
                 logger.info(f"✅ Connected to STT WebSocket: {uri}")
                 
                 async def send_audio():
@@ -223,6 +346,7 @@ class StreamSTTService:
                 
                 async def receive_results():
                     """Receive results. After send is done, apply a timeout for remaining results."""
+                    info_on = logger.isEnabledFor(logging.INFO)
                     try:
                         while True:
                             # If send is done, use a shorter timeout for remaining results
@@ -238,7 +362,8 @@ class StreamSTTService:
                             else:
                                 result = await websocket.recv()
                             
-                            logger.info(f"📝 Received: {result}")
+                            if info_on:
+                                logger.info("Received: %s", result)
                             results.append(result)
                             
                             if on_result:
@@ -263,14 +388,14 @@ class StreamSTTService:
     
     async def transcribe_realtime(
         self,
-        audio_chunks: list[bytes],
+        audio_chunks: Iterable[BufferLike],
         on_partial_result: Optional[Callable[[str, bool], None]] = None
     ) -> str:
         """
         Transcribe audio chunks in real-time with partial results
         
         Args:
-            audio_chunks: List of audio chunks (raw PCM int16 bytes)
+            audio_chunks: Audio chunks (raw PCM int16), any buffer type
             on_partial_result: Callback(text, is_final) for partial/final results
             
         Returns:
@@ -280,55 +405,47 @@ class StreamSTTService:
         final_text = ""
         
         try:
-            async with websockets.connect(uri) as websocket:
+            async with websockets.connect(uri, **STT_WS_OPTIONS) as websocket:
                 logger.info(f"✅ Connected to STT WebSocket: {uri}")
                 
-                # Send all chunks
-                for chunk in audio_chunks:
-                    await websocket.send(chunk)
-                    
-                    # Try to get partial results
-                    try:
-                        result = await asyncio.wait_for(
-                            websocket.recv(),
-                            timeout=0.01
-                        )
-                        
-                        # Parse result if JSON
-                        try:
-                            result_data = json.loads(result)
-                            text = result_data.get("text", result)
-                            is_final = result_data.get("is_final", False)
-                        except:
-                            text = result
-                            is_final = False
-                        
-                        if on_partial_result:
-                            on_partial_result(text, is_final)
-                        
-                        if is_final:
-                            final_text = text
-                            
-                    except asyncio.TimeoutError:
-                        pass
+                got_final = False
                 
-                # Get final result
-                try:
-                    result = await asyncio.wait_for(
-                        websocket.recv(),
-                        timeout=2.0
-                    )
-                    
+                def parse(result):
+                    # Parse result if JSON
                     try:
-                        result_data = json.loads(result)
-                        final_text = result_data.get("text", result)
-                    except:
-                        final_text = result
+                        result_data = _loads(result)
+                        return result_data.get("text", result), result_data.get("is_final", False)
+                    except (ValueError, TypeError, AttributeError):
+                        return result, False
+                
+                def handle(result):
+                    nonlocal final_text
+                    text, is_final = parse(result)
+                    if on_partial_result:
+                        on_partial_result(text, is_final)
                     
+                    if is_final:
+                        final_text = text
+                
+                def handle_final(result):
+                    # The first result after the last chunk is the final transcript
+                    nonlocal final_text, got_final
+                    got_final = True
+                    final_text, _ = parse(result)
                     if on_partial_result:
                         on_partial_result(final_text, True)
-                        
-                except asyncio.TimeoutError:
+                
+                # Send all chunks, several per frame, while receiving concurrently;
+                # then take the next result (within 2 s) as the final one
+                await self._send_and_receive(
+                    websocket,
+                    self._send_batched(websocket, audio_chunks),
+                    handle,
+                    final_timeout=2.0,
+                    on_final=handle_final
+                )
+                
+                if not got_final:
                     logger.warning("⏱️ Timeout waiting for final result")
                     
         except Exception as e:
@@ -375,8 +492,8 @@ async def example_usage():
         print(f"[{status}] {text}")
     
     # Simulate audio chunks
-    data, sr = sf.read("audio.wav", dtype='int16')
-    chunk_size = 4096
+    data, sr = _lazy_sf().read("audio.wav", dtype='int16')
+    chunk_size = 8000
     chunks = [
         data[i:i+chunk_size].tobytes() 
         for i in range(0, len(data), chunk_size)
@@ -4,14 +4,30 @@ import io
 import logging
 import json
 import subprocess
+import sys
 import tempfile
 import shutil
-from typing import Optional
+import struct
+from contextlib import asynccontextmanager
+from math import gcd
+from typing import Optional, Tuple, Union
 
 import websockets
-import soundfile as sf
 import numpy as np
 
+# orjson parses results 2-5x faster; stdlib json as fallback
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Optional: polyphase FIR resampling for the no-ffmpeg fallback
+try:
+    from scipy.signal import resample_poly
+except ImportError:
+    resample_poly = None
+
 logger = logging.getLogger(__name__)
 
 # Find ffmpeg executable: system PATH first, then imageio_ffmpeg fallback
@@ -24,9 +40,129 @@ if not FFMPEG_EXE:
         pass
 
 HAS_FFMPEG = FFMPEG_EXE is not None
+
+# Options for every STT websocket: PCM frames are sent raw (int16 audio is near-incompressible,
+# so permessage-deflate only burns CPU), no frame size cap, 1 MiB write buffer
+STT_WS_OPTIONS = {"compression": None, "max_size": None, "write_limit": 2 ** 20}
+
 logger.info(f"🔧 FFmpeg available: {HAS_FFMPEG}" + (f" ({FFMPEG_EXE})" if HAS_FFMPEG else " — audio/webm will NOT work!"))
 
 
+def _lazy_sf():
+    """Import soundfile (and libsndfile) only when a fallback path needs it"""
+    import soundfile
+    return soundfile
+
+
+def pcm16_wav_data(buf) -> Optional[Tuple[int, int]]:
+    """(offset, length) of the sample data if `buf` holds a 16 kHz mono PCM16 WAV
+    (already the STT wire format), otherwise None"""
+    if len(buf) < 12 or buf[0:4] != b"RIFF" or buf[8:12] != b"WAVE":
+        return None
+    pos = 12
+    fmt_ok = False
+    while pos + 8 <= len(buf):
+        chunk_id = buf[pos:pos + 4]
+        (size,) = struct.unpack_from("<I", buf, pos + 4)
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            if size < 16 or body + 16 > len(buf):
+                return None  # truncated header
+            audio_format, channels, sr, _, _, bits = struct.unpack_from("<HHIIHH", buf, body)
+            fmt_ok = audio_format == 1 and channels == 1 and sr == 16000 and bits == 16
+            if not fmt_ok:
+                return None
+        elif chunk_id == b"data":
+            if not fmt_ok:
+                return None
+            return body, min(size, len(buf) - body)
+        pos = body + size + (size & 1)  # chunks are word-aligned
+    return None
+
+
+class STTConnectionPool:
+    """
+    Up to `size` persistent STT connections shared by concurrent utterances.
+    Each utterance checks out an idle connection (or opens one while fewer than
+    `size` are in use), so N users share K TLS sessions instead of opening N.
+    """
+
+    def __init__(self, size: int = 1):
+        self.size = size
+        self._sem = asyncio.Semaphore(size)
+        self._idle: list = []  # (uri, ws); most recently used last
+
+    @asynccontextmanager
+    async def connection(self, uri: str):
+        """Check out a connection to `uri`; it is recycled unless the body raised"""
+        async with self._sem:
+            ws = await self._checkout(uri)
+            try:
+                yield ws
+            except BaseException:
+                await ws.close()
+                raise
+            if ws.state.name == "OPEN":
+                self._idle.append((uri, ws))
+
+    # How long a reused connection is polled for results left over from its last utterance
+    STALE_DRAIN_TIMEOUT = 0.01
+
+    async def _checkout(self, uri: str):
+        while self._idle:
+            idle_uri, ws = self._idle.pop()
+            if idle_uri == uri and ws.state.name == "OPEN":
+                try:
+                    await self._drain_stale(ws)
+                except websockets.exceptions.ConnectionClosed:
+                    continue
+                return ws
+            # Model/lang changed or connection died
+            await ws.close()
+        ws = await websockets.connect(uri, ping_interval=20, ping_timeout=20, **STT_WS_OPTIONS)
+        logger.info(f"✅ Connected to STT (keep-alive): {uri}")
+        return ws
+
+    async def _drain_stale(self, ws):
+        """Drop results that arrived after the previous utterance stopped listening,
+        so they are not taken for this utterance's transcript"""
+        while True:
+            try:
+                stale = await asyncio.wait_for(ws.recv(), timeout=self.STALE_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                return
+            logger.debug("Dropped stale STT result: %s", stale)
+
+    async def close(self):
+        """Close all idle connections"""
+        idle, self._idle = self._idle, []
+        for _, ws in idle:
+            await ws.close()
+
+
+def _downmix_to_mono(data: np.ndarray) -> np.ndarray:
+    """Average the channels of (frames, channels) int16 audio, writing straight into the result"""
+    channels = data.shape[1]
+    summed = data.sum(axis=1, dtype=np.int32)
+    mono = np.empty(len(summed), dtype=np.int16)
+    if channels == 2:
+        np.right_shift(summed, 1, out=mono, casting="unsafe")
+    else:
+        np.floor_divide(summed, channels, out=mono, casting="unsafe")
+    return mono
+
+
+def _resample_to_16k(data: np.ndarray, sr: int) -> np.ndarray:
+    """Resample mono int16 audio to 16 kHz (polyphase FIR if scipy is available, else linear)"""
+    if resample_poly is not None:
+        g = gcd(sr, 16000)
+        out = resample_poly(data, 16000 // g, sr // g)
+        return np.clip(out, -32768, 32767).astype(np.int16)
+    new_len = int(len(data) * 16000 / sr)
+    positions = np.arange(new_len) * (sr / 16000)
+    return np.interp(positions, np.arange(len(data)), data).astype(np.int16)
+
+
 class STTService:
     """
     Speech-to-Text service.
@@ -43,17 +179,26 @@ class STTService:
         self.ws_url = ws_url or os.getenv("STT_WS_URL", "wss://cahy-stt.anm05.com/stream")
         self.model = model
         self.lang = lang
+        # Reuse STT connections across utterances. Needs a server that accepts the
+        # {"end": true} utterance terminator. STT_POOL_SIZE=N keeps up to N
+        # persistent connections; each carries one utterance at a time (0 = a new
+        # connection per utterance). STT_KEEPALIVE=1 is shorthand for a pool of 1.
+        pool_size = int(os.getenv("STT_POOL_SIZE", "0"))
+        if not pool_size and os.getenv("STT_KEEPALIVE", "0") == "1":
+            pool_size = 1
+        self.keep_alive = pool_size > 0
+        self._ws_pool = STTConnectionPool(pool_size) if pool_size else None
         logger.info(f"🔧 STT init: ffmpeg={'✅ ' + str(FFMPEG_EXE) if HAS_FFMPEG else '❌ NOT FOUND'}")
 
     def _get_ws_url(self) -> str:
         return f"{self.ws_url}?model={self.model}&lang={self.lang}"
 
-    async def transcribe(self, audio_bytes: bytes, mime_type: str = "audio/webm") -> str:
+    async def transcribe(self, audio_bytes: Union[bytes, bytearray], mime_type: str = "audio/webm") -> str:
         """
         Transcribe audio bytes to text.
 
         Args:
-            audio_bytes: Raw audio data (WebM, WAV, etc.)
+            audio_bytes: Raw audio data (WebM, WAV, etc.); any bytes-like buffer
             mime_type: MIME type of the audio
 
         Returns:
@@ -62,6 +207,18 @@ class STTService:
         if not audio_bytes:
             return ""
 
+        located = pcm16_wav_data(audio_bytes)
+        if located is not None:
+            # Already 16 kHz mono PCM16: send the data chunk without decoding
+            offset, length = located
+            return await self._stt_websocket(memoryview(audio_bytes)[offset:offset + length])
+
+        if HAS_FFMPEG and sys.platform != "win32":
+            # Stream ffmpeg output straight into the STT socket while it decodes
+            return await self._run_stt(
+                lambda ws, results, end_frame: self._ffmpeg_pipe_to_ws(audio_bytes, ws, results, end_frame)
+            )
+
         # Convert to PCM int16 mono 16kHz
         pcm_bytes = await self._to_pcm(audio_bytes, mime_type)
         if not pcm_bytes:
@@ -74,29 +231,29 @@ class STTService:
     async def _to_pcm(self, audio_bytes: bytes, mime_type: str) -> Optional[bytes]:
         """Convert any audio format to raw PCM int16 mono 16kHz"""
 
-        # If we have ffmpeg, use it (handles WebM, Opus, MP3, etc.)
+        # If we have ffmpeg, use it (handles WebM, Opus, MP3, etc.). Only reached on
+        # Windows: elsewhere transcribe() pipes ffmpeg output straight into the socket.
+        # The selector loop used by uvicorn --reload on Windows has no subprocess
+        # support, so this goes through temp files
         if HAS_FFMPEG:
-            return await self._ffmpeg_to_pcm(audio_bytes)
+            return await self._ffmpeg_to_pcm_tempfile(audio_bytes)
 
         # Fallback: try soundfile (only works with WAV/FLAC/OGG, NOT WebM)
         try:
             audio_io = io.BytesIO(audio_bytes)
-            data, sr = sf.read(audio_io, dtype='int16')
-            # If stereo, convert to mono
+            data, sr = _lazy_sf().read(audio_io, dtype='int16')
+            # If stereo, downmix to mono (average all channels)
             if data.ndim > 1:
-                data = data[:, 0]
-            # Resample to 16kHz if needed (simple decimation)
+                data = _downmix_to_mono(data)
+            # Resample to 16kHz if needed
             if sr != 16000:
-                ratio = 16000 / sr
-                new_len = int(len(data) * ratio)
-                indices = np.linspace(0, len(data) - 1, new_len).astype(int)
-                data = data[indices]
+                data = _resample_to_16k(data, sr)
             return data.tobytes()
         except Exception as e:
             logger.error(f"❌ soundfile fallback failed: {e}")
             return None
 
-    async def _ffmpeg_to_pcm(self, audio_bytes: bytes) -> Optional[bytes]:
+    async def _ffmpeg_to_pcm_tempfile(self, audio_bytes: bytes) -> Optional[bytes]:
         """Use ffmpeg to convert any audio to PCM int16 mono 16kHz.
         Uses temp files instead of pipes for Windows compatibility."""
         tmp_in_path = None
@@ -132,13 +289,17 @@ class STTService:
                 logger.error(f"❌ ffmpeg error: {result.stderr.decode('utf-8', errors='replace')}")
                 return None
 
-            if not os.path.exists(tmp_out_path) or os.path.getsize(tmp_out_path) == 0:
+            if not os.path.exists(tmp_out_path):
                 logger.warning("⚠️ ffmpeg returned empty output")
                 return None
 
             with open(tmp_out_path, "rb") as f:
                 pcm_data = f.read()
 
+            if not pcm_data:
+                logger.warning("⚠️ ffmpeg returned empty output")
+                return None
+
             logger.info(f"✅ ffmpeg converted: {len(audio_bytes)} → {len(pcm_data)} bytes PCM")
             return pcm_data
 
@@ -154,44 +315,170 @@ class STTService:
                 except Exception:
                     pass
 
-    async def _stt_websocket(self, pcm_bytes: bytes) -> str:
+    async def _stt_websocket(self, pcm_bytes: Union[bytes, memoryview]) -> str:
         """Send PCM audio to STT WebSocket and get transcript"""
-        uri = self._get_ws_url()
+        return await self._run_stt(
+            lambda ws, results, end_frame: self._send_and_collect(ws, pcm_bytes, results, end_frame)
+        )
+
+    async def _run_stt(self, exchange) -> str:
+        """Open (or reuse) an STT connection, run `exchange(ws, results, end_frame)`
+        to send audio and gather raw results, then return the transcript"""
         results = []
-        CHUNK_SIZE = 8192  # Send in 8KB chunks
 
         try:
-            async with websockets.connect(uri) as ws:
-                logger.info(f"✅ Connected to STT: {uri}")
+            if self.keep_alive:
+                await self._stt_shared_websocket(exchange, results)
+            else:
+                uri = self._get_ws_url()
+                async with websockets.connect(uri, **STT_WS_OPTIONS) as ws:
+                    logger.info(f"✅ Connected to STT: {uri}")
+                    await exchange(ws, results, False)
 
-                # Send PCM in chunks
-                for i in range(0, len(pcm_bytes), CHUNK_SIZE):
-                    chunk = pcm_bytes[i:i + CHUNK_SIZE]
-                    await ws.send(chunk)
+        except Exception as e:
+            logger.error(f"❌ STT WebSocket error: {e}")
 
-                    # Non-blocking receive for partial results
-                    try:
-                        result = await asyncio.wait_for(ws.recv(), timeout=0.01)
-                        results.append(result)
-                    except asyncio.TimeoutError:
-                        pass
+        # Extract text from results
+        return self._parse_results(results)
 
-                logger.info(f"📤 Sent {len(pcm_bytes)} bytes PCM, waiting for results...")
+    async def _stt_shared_websocket(self, exchange, results: list):
+        """Run one utterance over a pooled long-lived connection, reconnecting once if it dropped"""
+        uri = self._get_ws_url()
+        for attempt in range(2):
+            try:
+                async with self._ws_pool.connection(uri) as ws:
+                    await exchange(ws, results, True)
+                return
+            except websockets.exceptions.ConnectionClosed:
+                if attempt or results:
+                    raise
+                logger.info("🔌 STT connection dropped, reconnecting")
+
+    async def close(self):
+        """Close the pooled STT connections, if any"""
+        if self._ws_pool is not None:
+            await self._ws_pool.close()
+
+    async def _send_and_collect(
+        self,
+        ws,
+        pcm_bytes: Union[bytes, memoryview],
+        results: list,
+        end_frame: bool = False,
+    ):
+        """Send PCM in chunks while receiving partial results, then collect
+        results until the server goes quiet"""
+        CHUNK_SIZE = 16384  # 16 KB chunks: one TLS record, one WS frame each
 
-                # Wait for final results
+        receiver = asyncio.create_task(self._receive_into(ws, results))
+        try:
+            # Send PCM in chunks, as zero-copy slices
+            with memoryview(pcm_bytes) as mv:
+                for i in range(0, len(mv), CHUNK_SIZE):
+                    with mv[i:i + CHUNK_SIZE] as chunk:
+                        await ws.send(chunk)
+
+            if end_frame:
+                # Mark the utterance boundary on a reused connection
+                await ws.send(json.dumps({"end": True}))
+        finally:
+            await self._stop_receiver(receiver)
+
+        logger.info(f"📤 Sent {len(pcm_bytes)} bytes PCM, waiting for results...")
+        await self._collect_final(ws, results)
+
+    async def _ffmpeg_pipe_to_ws(self, audio_bytes: bytes, ws, results: list, end_frame: bool = False):
+        """Decode with ffmpeg and forward its PCM output to the socket as it is produced:
+        feed stdin, forward stdout in 32 KB reads, and receive partial results concurrently"""
+        READ_SIZE = 32768
+        sent = 0
+
+        proc = await asyncio.create_subprocess_exec(
+            FFMPEG_EXE,
+            "-hide_banner", "-loglevel", "error",
+            "-i", "pipe:0",
+            "-f", "s16le", "-ac", "1", "-ar", "16000",
+            "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+        async def feed():
+            try:
+                proc.stdin.write(audio_bytes)
+                await proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # ffmpeg exited early; its stderr says why
+            finally:
+                proc.stdin.close()
+
+        async def forward():
+            nonlocal sent
+            while True:
+                chunk = await proc.stdout.read(READ_SIZE)
+                if not chunk:
+                    break
+                await ws.send(chunk)
+                sent += len(chunk)
+            if end_frame and sent:
+                # Mark the utterance boundary on a reused connection
+                await ws.send(json.dumps({"end": True}))
+
+        # Drained concurrently: a full stderr pipe would stall ffmpeg mid-conversion
+        stderr_task = asyncio.create_task(proc.stderr.read())
+        receiver = asyncio.create_task(self._receive_into(ws, results))
+        try:
+            await asyncio.wait_for(asyncio.gather(feed(), forward()), timeout=15)
+        except asyncio.TimeoutError:
+            logger.error("❌ ffmpeg timed out")
+        finally:
+            if proc.returncode is None and not proc.stdout.at_eof():
+                # Timed out or the socket failed mid-stream
                 try:
-                    while True:
-                        result = await asyncio.wait_for(ws.recv(), timeout=3.0)
-                        results.append(result)
-                        logger.info(f"📝 STT result: {result}")
-                except asyncio.TimeoutError:
+                    proc.kill()
+                except ProcessLookupError:
                     pass
+            await self._stop_receiver(receiver)
+            # Reap ffmpeg and finish its stderr reader on every exit path
+            await proc.wait()
+            stderr = await stderr_task
+
+        if proc.returncode != 0 and not sent:
+            logger.error(f"❌ ffmpeg error: {stderr.decode('utf-8', errors='replace')}")
+            return
+
+        if not sent:
+            logger.warning("⚠️ ffmpeg returned empty output")
+            return
+
+        logger.info(f"📤 Streamed {len(audio_bytes)} → {sent} bytes PCM, waiting for results...")
+        await self._collect_final(ws, results)
+
+    async def _receive_into(self, ws, results: list):
+        """Append results as they arrive; runs until cancelled"""
+        while True:
+            results.append(await ws.recv())
+
+    async def _stop_receiver(self, receiver: asyncio.Task):
+        """Cancel a `_receive_into` task. A closed socket surfaces later, in `_collect_final`"""
+        receiver.cancel()
+        try:
+            await receiver
+        except (asyncio.CancelledError, websockets.exceptions.ConnectionClosed):
+            pass
 
-        except Exception as e:
-            logger.error(f"❌ STT WebSocket error: {e}")
-
-        # Extract text from results
-        return self._parse_results(results)
+    async def _collect_final(self, ws, results: list):
+        """Collect results until the server has been quiet for 3 s"""
+        info_on = logger.isEnabledFor(logging.INFO)
+        try:
+            while True:
+                result = await asyncio.wait_for(ws.recv(), timeout=3.0)
+                results.append(result)
+                if info_on:
+                    logger.info("STT result: %s", result)
+        except asyncio.TimeoutError:
+            pass
 
     def _parse_results(self, results: list) -> str:
         """Parse STT results and return the best transcript"""
@@ -199,12 +486,15 @@ class STTService:
         for result in results:
             try:
                 if isinstance(result, str):
-                    # Try JSON parse
-                    try:
-                        data = json.loads(result)
-                        text = data.get("text", "").strip()
-                    except (json.JSONDecodeError, TypeError):
+                    if not result or result[0] not in "{[":
+                        # Plain-text result, skip the JSON attempt
                         text = result.strip()
+                    else:
+                        try:
+                            data = _loads(result)
+                            text = data.get("text", "").strip()
+                        except (ValueError, TypeError, AttributeError):
+                            text = result.strip()
                 else:
                     text = str(result).strip()
 
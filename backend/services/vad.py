@@ -1,5 +1,8 @@
+import asyncio
 import logging
-import numpy as np
+import os
+import threading
+import warnings
 
 logger = logging.getLogger(__name__)
 
@@ -9,12 +12,26 @@ class SileroVoiceActivityDetector:
         self.threshold = threshold
         self._model = None
         self._torch = None
+        self._scratch = None  # reusable (1, N) float32 input tensor
+        self._load_lock = threading.Lock()
+
+    async def preload(self):
+        """Load torch + the model in a worker thread (call from app startup),
+        so the first request doesn't pay the cold start"""
+        await asyncio.get_running_loop().run_in_executor(None, self._ensure_loaded)
 
     def _ensure_loaded(self):
         if self._model is not None:
             return
+        with self._load_lock:
+            if self._model is None:
+                self._load()
+
+    def _load(self):
         import torch
         self._torch = torch
+        # Persistent hub cache so restarts don't re-download the model
+        torch.hub.set_dir(os.getenv("TORCH_HUB_DIR", "/tmp/torch_hub"))
         try:
             model, _ = torch.hub.load(
                 repo_or_dir="snakers4/silero-vad",
@@ -28,21 +45,50 @@ class SileroVoiceActivityDetector:
                 model="silero_vad",
                 verbose=False,
             )
+        model.eval()
+
+        # Newer hub releases already return TorchScript; script older eager models
+        if not isinstance(model, torch.jit.ScriptModule):
+            try:
+                model = torch.jit.script(model)
+            except Exception as e:
+                logger.warning(f"⚠️ Silero VAD could not be scripted, using eager model: {e}")
+        if isinstance(model, torch.jit.ScriptModule):
+            try:
+                # freeze() drops methods other than forward unless told to keep them;
+                # without reset_states, VAD state would leak across utterances
+                model = torch.jit.freeze(model, preserved_attrs=["reset_states"])
+            except Exception as e:
+                logger.debug(f"Silero VAD freeze skipped: {e}")
+
+        # Frames are tiny (<1 ms kernels); intra-op parallelism only adds scheduling overhead
+        torch.set_num_threads(1)
+
+        # Warm up so the first real frame runs on steady-state kernels
+        warmup_samples = 512 if self.sample_rate == 16000 else 256
+        with torch.inference_mode():
+            model(torch.zeros(1, warmup_samples), self.sample_rate)
+        if hasattr(model, "reset_states"):
+            model.reset_states()
+
         self._model = model
-        self._model.eval()
 
     def speech_probability(self, pcm16le_bytes: bytes) -> float:
         self._ensure_loaded()
-        if not pcm16le_bytes:
+        torch = self._torch
+        n = len(pcm16le_bytes) // 2
+        if n == 0:
             return 0.0
-        audio_int16 = np.frombuffer(pcm16le_bytes, dtype=np.int16)
-        if audio_int16.size == 0:
-            return 0.0
-        audio = audio_int16.astype(np.float32) / 32768.0
-        x = self._torch.from_numpy(audio)
-        if x.ndim == 1:
-            x = x.unsqueeze(0)
-        with self._torch.no_grad():
+        if self._scratch is None or self._scratch.shape[1] < n:
+            self._scratch = torch.empty(1, n * 2, dtype=torch.float32)
+        # int16 view of the input, scaled straight into the scratch tensor
+        with warnings.catch_warnings():
+            # torch.frombuffer() warns on read-only `bytes`; we never write through that view
+            warnings.filterwarnings("ignore", message="The given buffer is not writable")
+            audio_int16 = torch.frombuffer(pcm16le_bytes, dtype=torch.int16, count=n)
+        x = self._scratch[:, :n]
+        torch.mul(audio_int16, 1.0 / 32768.0, out=x[0])
+        with torch.inference_mode():
             prob = self._model(x, self.sample_rate).item()
         return float(prob)
 
@@ -71,6 +117,7 @@ class VoiceActivityDetector:
         if frame_duration_ms not in [10, 20, 30]:
             raise ValueError(f"Frame duration {frame_duration_ms}ms not supported. Must be 10, 20, or 30")
         
+        import webrtcvad
         self.vad = webrtcvad.Vad(2)  # Aggressiveness: 0-3, 2 is moderate
         self.frame_size = int(sample_rate * frame_duration_ms / 1000)
         self.silence_frames = int(silence_threshold_ms / frame_duration_ms)
@@ -93,13 +140,43 @@ class VoiceActivityDetector:
             logger.error(f"❌ VAD error: {e}")
             return False
     
+    def classify_frames(self, audio_chunk) -> list:
+        """
+        Speech decision for every whole frame in a PCM chunk, in order.
+        One call per chunk, so a multi-stream server can run it in a worker
+        thread (loop.run_in_executor) instead of calling into Python per frame.
+        """
+        frame_bytes = self.frame_size * 2  # 2 bytes per sample (16-bit)
+        sample_rate = self.sample_rate
+        vad_is_speech = self.vad.is_speech
+        # memoryview slices avoid per-frame copies
+        view = memoryview(audio_chunk)
+        usable = len(view) - len(view) % frame_bytes
+        
+        try:
+            return [
+                vad_is_speech(view[i:i + frame_bytes], sample_rate)
+                for i in range(0, usable, frame_bytes)
+            ]
+        except Exception as e:
+            logger.error(f"❌ VAD error: {e}")
+            # Fall back to per-frame calls so one bad frame doesn't drop the chunk
+            decisions = []
+            for i in range(0, usable, frame_bytes):
+                try:
+                    decisions.append(vad_is_speech(view[i:i + frame_bytes], sample_rate))
+                except Exception:
+                    decisions.append(False)
+            return decisions
+    
     def detect_silence_stream(self, audio_generator):
         """
         Detect silence in audio stream
         Yields: (is_speech: bool, silence_duration_ms: float)
         """
         silence_frame_count = 0
-        total_frames = 0
+        frame_duration_ms = self.frame_duration_ms
+        threshold_frames = -(-self.silence_threshold_ms // frame_duration_ms)  # ceil
         
         for audio_chunk in audio_generator:
             if audio_chunk is None:
@@ -109,29 +186,16 @@ class VoiceActivityDetector:
             # For now, assume audio is already PCM 16-bit mono
             # In practice, you'd need to convert WebM to PCM first
             
-            # Check each frame in the chunk
-            chunk_size = len(audio_chunk)
-            num_frames = chunk_size // (self.frame_size * 2)
-            
-            for i in range(num_frames):
-                frame_start = i * self.frame_size * 2
-                frame_end = frame_start + self.frame_size * 2
-                if frame_end > chunk_size:
-                    break
-                
-                frame = audio_chunk[frame_start:frame_end]
-                is_speech_frame = self.is_speech(frame)
-                total_frames += 1
-                
+            # Decide the whole chunk at once, then walk the decisions
+            for is_speech_frame in self.classify_frames(audio_chunk):
                 if is_speech_frame:
                     silence_frame_count = 0
                     yield (True, 0.0)
                 else:
                     silence_frame_count += 1
-                    silence_duration_ms = silence_frame_count * self.frame_duration_ms
-                    yield (False, silence_duration_ms)
+                    yield (False, silence_frame_count * frame_duration_ms)
                     
                     # Check if silence threshold reached
-                    if silence_duration_ms >= self.silence_threshold_ms:
-                        logger.info(f"🔇 Silence detected: {silence_duration_ms:.0f}ms")
+                    if silence_frame_count >= threshold_frames:
+                        logger.info(f"🔇 Silence detected: {silence_frame_count * frame_duration_ms:.0f}ms")
                         return  # Stop processing, silence detected
@@ -2,65 +2,250 @@ import asyncio
 import logging
 import json
 import base64
+import os
 import uuid
 import re
-from typing import Dict, Any
+import types
+from typing import Dict, Any, Union
+
+# orjson encodes/decodes straight to/from UTF-8, 3-10x faster; stdlib json as fallback
+try:
+    import orjson
+    _loads = orjson.loads
+
+    def _dumps(data) -> str:
+        return orjson.dumps(data).decode()
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(data) -> str:
+        return json.dumps(data, ensure_ascii=False)
+
+# pybase64 dispatches to SIMD (AVX2/NEON) kernels; stdlib base64 as fallback
+try:
+    import pybase64 as b64
+except ImportError:
+    b64 = base64
+
+# Constant messages, serialized once
+_AI_PROCESSING_ON = _dumps({"type": "ai_processing", "isProcessing": True})
+_AI_PROCESSING_OFF = _dumps({"type": "ai_processing", "isProcessing": False})
+
+# pybase64 can decode straight into a bytearray (no intermediate bytes object)
+_b64decode_to_buffer = getattr(b64, "b64decode_as_bytearray", b64.b64decode)
+
+# ... and encode straight to str, skipping the bytes result + .decode() copy
+_b64encode_to_str = getattr(
+    b64, "b64encode_as_string", lambda data: b64.b64encode(data).decode("ascii")
+)
 
 logger = logging.getLogger(__name__)
 
+# Compiled once: the pipeline runs these on every streamed chunk
+_SENT_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+
+
+class _TagStripper:
+    """
+    Removes [TAG]s from streamed text one chunk at a time, carrying an open
+    tag across chunk boundaries, and remembers the first tag (the emotion).
+    A "[" not closed on the same line within MAX_TAG_LEN chars is plain text.
+    """
+
+    MAX_TAG_LEN = 32
+
+    __slots__ = ("pending", "first_tag")
+
+    def __init__(self):
+        self.pending = ""  # an open "[..." that may still turn out to be a tag
+        self.first_tag = None
+
+    def feed(self, chunk: str) -> str:
+        """Return the part of `chunk` outside tags"""
+        text = self.pending + chunk if self.pending else chunk
+        self.pending = ""
+        out = []
+        pos, n = 0, len(text)
+        while pos < n:
+            start = text.find("[", pos)
+            if start < 0:
+                out.append(text[pos:])
+                break
+            out.append(text[pos:start])
+            # The closing "]" must come within MAX_TAG_LEN chars, before any newline
+            limit = min(n, start + self.MAX_TAG_LEN + 2)
+            end = text.find("]", start + 1, limit)
+            nl = text.find("\n", start + 1, end if end >= 0 else limit)
+            if end >= 0 and nl < 0:
+                if self.first_tag is None:
+                    self.first_tag = text[start + 1:end]
+                pos = end + 1
+            elif nl >= 0 or limit < n or n - start > self.MAX_TAG_LEN + 1:
+                # Not a tag: keep the "[" and rescan what follows it
+                out.append("[")
+                pos = start + 1
+            else:
+                self.pending = text[start:]
+                break
+        return "".join(out)
+
+    def flush(self) -> str:
+        """At end of stream: return a tag that was opened but never closed, as plain text"""
+        text, self.pending = self.pending, ""
+        return text
+
 
 class SessionManager:
     """
     Session manager for voice chat:
-    - FE records audio with VAD (silence detection) → sends complete blob as base64
+    - FE records audio with VAD (silence detection) → sends complete blob as binary
+      frames + audio_end (or, for older clients, base64 in audio_complete)
     - BE decodes → STT (file-based) → AI → TTS → response
     """
 
+    # base64 payloads at least this large are (de)coded in a worker thread so the
+    # event loop keeps serving other sessions; smaller ones are not worth the hop
+    B64_THREAD_MIN = 256 * 1024
+
+    # Largest accepted utterance: 12 MiB of base64 (~9 MiB of audio); binary uploads
+    # get the decoded equivalent. Anything bigger is rejected before decoding/buffering.
+    # Keep it below uvicorn's ws_max_size (16 MiB): larger frames close the socket
+    # before they ever reach handle_message
+    MAX_AUDIO_B64_BYTES = int(os.getenv("MAX_AUDIO_B64_BYTES", str(12 * 1024 * 1024)))
+    MAX_AUDIO_BYTES = MAX_AUDIO_B64_BYTES * 3 // 4
+
     def __init__(self, websocket, services: Dict[str, Any], settings: Dict[str, Any]):
         self.websocket = websocket
         self.services = services
         self.settings = settings.copy()
         self.session_id = str(uuid.uuid4())
 
+        # TTS settings read per sentence; refreshed in _handle_update_settings
+        self._tts_cfg = types.SimpleNamespace(prompt=None, lang="vi", binary=False)
+        self._refresh_tts_cfg(self.settings)
+
         # TTS stop signal
         self.tts_stop_event = asyncio.Event()
+        # Plain-bool shadow of tts_stop_event for the per-chunk checks; the Event
+        # stays for anything that needs to await the stop
+        self._tts_stop = False
 
         # WebSocket state
         self._ws_closed = False
 
-        logger.info(f"✅ Session initialized: {self.session_id}")
+        # Raw audio received as binary frames, until the audio_end message
+        self._pending_audio = bytearray()
+        self._pending_audio_overflow = False
+
+        # Outbound messages: producers enqueue, one writer task sends
+        self._tx_q: asyncio.Queue = asyncio.Queue(maxsize=256)
+        self._writer_task = None
+
+        logger.info("✅ Session initialized: %s", self.session_id)
 
     # ── WebSocket helpers ──────────────────────────────────────────
 
-    async def _safe_send_json(self, data: dict):
-        """Send JSON, silently ignore if connection closed"""
+    async def _safe_send_json(self, data: Union[dict, str]):
+        """Queue JSON (a dict, or already-serialized text) for the writer task,
+        silently ignore if connection closed"""
         if self._ws_closed:
             return
-        try:
-            await self.websocket.send_json(data)
-        except Exception as e:
-            logger.debug(f"WS send failed: {e}")
-            self._ws_closed = True
+        # Waits only when the writer is 256 messages behind
+        await self._tx_q.put(data)
+
+    async def _safe_send_binary(self, header: dict, payload: bytes):
+        """Queue a JSON header and the binary frame that follows it, as one unit"""
+        if self._ws_closed:
+            return
+        await self._tx_q.put((header, payload))
+
+    async def _writer_loop(self):
+        """Drain everything queued so far, encode it in one go and send it back-to-back"""
+        q = self._tx_q
+        send_text = self.websocket.send_text
+        send_bytes = self.websocket.send_bytes
+        while True:
+            batch = [await q.get()]
+            while True:
+                try:
+                    batch.append(q.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            if self._ws_closed:
+                continue
+            # JSON goes out as text frames (the FE treats every binary frame as
+            # audio), raw payloads as binary frames
+            frames = []
+            for item in batch:
+                if isinstance(item, str):
+                    frames.append(item)
+                elif isinstance(item, tuple):
+                    header, payload = item
+                    frames.append(_dumps(header))
+                    frames.append(payload)
+                else:
+                    frames.append(_dumps(item))
+            try:
+                for frame in frames:
+                    if isinstance(frame, str):
+                        await send_text(frame)
+                    else:
+                        await send_bytes(frame)
+            except Exception as e:
+                logger.debug("WS send failed: %s", e)
+                self._ws_closed = True
 
     # ── Lifecycle ──────────────────────────────────────────────────
 
     async def start(self):
+        self._writer_task = asyncio.create_task(self._writer_loop())
         await self._safe_send_json({
             "type": "session_init",
             "session_id": self.session_id
         })
 
+    def _set_tts_stop(self, stop: bool):
+        self._tts_stop = stop
+        if stop:
+            self.tts_stop_event.set()
+        else:
+            self.tts_stop_event.clear()
+
+    def _reset_pending_audio(self):
+        """Drop binary audio frames still waiting for their audio_end"""
+        self._pending_audio = bytearray()
+        self._pending_audio_overflow = False
+
     async def cleanup(self):
-        self.tts_stop_event.set()
+        self._set_tts_stop(True)
+        self._reset_pending_audio()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
 
     # ── Message routing ────────────────────────────────────────────
 
     async def handle_message(self, message):
-        if "text" not in message:
+        if message.get("bytes") is not None:
+            # Binary frame = a piece of the current utterance's audio, sent raw
+            if len(self._pending_audio) + len(message["bytes"]) > self.MAX_AUDIO_BYTES:
+                # Stop buffering; audio_end reports the error
+                self._pending_audio = bytearray()
+                self._pending_audio_overflow = True
+            elif not self._pending_audio_overflow:
+                self._pending_audio += message["bytes"]
+            return
+
+        if message.get("text") is None:
             return
 
         try:
-            data = json.loads(message["text"])
+            # orjson.JSONDecodeError subclasses json.JSONDecodeError.
+            # Pop the raw text so it is not kept alive for the whole turn
+            data = _loads(message.pop("text"))
             msg_type = data.get("type")
 
             if msg_type == "update_settings":
@@ -72,19 +257,38 @@ class SessionManager:
                     await self._process_pipeline(text)
 
             elif msg_type == "audio_complete":
-                audio_b64 = data.get("data", "")
+                # A base64 upload replaces any binary frames sent without audio_end
+                self._reset_pending_audio()
                 mime_type = data.get("mimeType", "audio/webm")
-                if audio_b64:
-                    await self._handle_audio(audio_b64, mime_type)
+                if data.get("data"):
+                    # Hand over the only reference so _handle_audio can free it after decoding
+                    await self._handle_audio(data.pop("data"), mime_type)
+
+            elif msg_type == "audio_end":
+                # Audio arrived as binary frames: no base64 or JSON on this path
+                audio, self._pending_audio = self._pending_audio, bytearray()
+                if self._pending_audio_overflow:
+                    self._pending_audio_overflow = False
+                    logger.warning("⚠️ Rejected oversized audio upload")
+                    await self._safe_send_json({"type": "stt_error", "message": "Audio too large"})
+                elif audio:
+                    await self._handle_audio_bytes(audio, data.get("mimeType", "audio/webm"))
 
             elif msg_type == "user_speaking":
-                self.tts_stop_event.set()
+                self._set_tts_stop(True)
 
         except json.JSONDecodeError:
             logger.error("Invalid JSON received")
 
+    def _refresh_tts_cfg(self, new_settings):
+        cfg = self._tts_cfg
+        cfg.prompt = new_settings.get("ttsAudioPrompt", cfg.prompt)
+        cfg.lang = new_settings.get("ttsLanguage", cfg.lang)
+        cfg.binary = bool(new_settings.get("binaryAudio", cfg.binary))
+
     def _handle_update_settings(self, new_settings):
         self.settings.update(new_settings)
+        self._refresh_tts_cfg(new_settings)
         ai = self.services["ai"]
         stt = self.services["stt"]
         tts = self.services["tts"]
@@ -105,11 +309,11 @@ class SessionManager:
 
         if "sttModel" in new_settings and new_settings["sttModel"]:
             stt.model = new_settings["sttModel"]
-            logger.info(f"🎤 STT model updated: {stt.model}")
+            logger.info("🎤 STT model updated: %s", stt.model)
 
         if "ttsVoice" in new_settings and new_settings["ttsVoice"]:
             tts.default_voice = new_settings["ttsVoice"]
-            logger.info(f"🔊 TTS voice updated: {tts.default_voice}")
+            logger.info("🔊 TTS voice updated: %s", tts.default_voice)
 
         logger.info("⚙️ Settings updated")
 
@@ -117,26 +321,41 @@ class SessionManager:
 
     async def _handle_audio(self, audio_b64: str, mime_type: str):
         """Decode base64 audio → STT → AI → TTS"""
-        logger.info(f"🎤 Received audio ({len(audio_b64)} chars b64)")
+        logger.debug("🎤 Received audio (%d chars b64)", len(audio_b64))
+
+        if len(audio_b64) > self.MAX_AUDIO_B64_BYTES:
+            logger.warning("⚠️ Rejected oversized audio (%d chars b64)", len(audio_b64))
+            await self._safe_send_json({"type": "stt_error", "message": "Audio too large"})
+            return
 
         # 1. Decode base64
         try:
-            audio_bytes = base64.b64decode(audio_b64)
+            # FileReader.readAsDataURL emits canonical base64, so strict validation is safe
+            if len(audio_b64) >= self.B64_THREAD_MIN:
+                audio_bytes = await asyncio.to_thread(_b64decode_to_buffer, audio_b64, validate=True)
+            else:
+                audio_bytes = _b64decode_to_buffer(audio_b64, validate=True)
         except Exception as e:
-            logger.error(f"❌ Base64 decode failed: {e}")
+            logger.error("❌ Base64 decode failed: %s", e)
             await self._safe_send_json({"type": "stt_error", "message": "Audio decode failed"})
             return
+        # Release the encoded copy before the long STT → AI → TTS turn
+        del audio_b64
 
-        logger.info(f"📦 Audio: {len(audio_bytes)} bytes ({mime_type})")
+        await self._handle_audio_bytes(audio_bytes, mime_type)
+
+    async def _handle_audio_bytes(self, audio_bytes: bytes, mime_type: str):
+        """Raw audio → STT → AI → TTS"""
+        logger.debug("📦 Audio: %d bytes (%s)", len(audio_bytes), mime_type)
 
         # 2. STT
-        await self._safe_send_json({"type": "ai_processing", "isProcessing": True})
+        await self._safe_send_json(_AI_PROCESSING_ON)
 
         try:
             stt = self.services["stt"]
             transcript = await stt.transcribe(audio_bytes, mime_type)
         except Exception as e:
-            logger.error(f"❌ STT error: {e}")
+            logger.error("❌ STT error: %s", e)
             await self._safe_send_json({"type": "stt_error", "message": str(e)})
             return
 
@@ -147,10 +366,10 @@ class SessionManager:
                 "text": "(Không nhận diện được giọng nói)",
                 "isFinal": True
             })
-            await self._safe_send_json({"type": "ai_processing", "isProcessing": False})
+            await self._safe_send_json(_AI_PROCESSING_OFF)
             return
 
-        logger.info(f"📝 Transcript: {transcript}")
+        logger.info("📝 Transcript: %s", transcript)
 
         # 3. Send transcript to FE
         await self._safe_send_json({
@@ -166,81 +385,144 @@ class SessionManager:
 
     async def _process_pipeline(self, input_text: str):
         """Run AI streaming + sentence-level TTS"""
-        self.tts_stop_event.clear()
-        await self._safe_send_json({"type": "ai_processing", "isProcessing": True})
+        self._set_tts_stop(False)
+        await self._safe_send_json(_AI_PROCESSING_ON)
 
+        # Loop invariants, bound once per turn
         ai = self.services["ai"]
-        full_response = ""
-        emotion = "NEUTRAL"
+        send = self._safe_send_json
+        split_sentences = _SENT_SPLIT_RE.finditer
+        tags = _TagStripper()
+        feed_tags = tags.feed
+        clean_parts = []
         sentence_buffer = ""
         clean_so_far = ""
+        # Clients that set streamDeltas get only the newly appended text per chunk;
+        # the legacy ai_stream_chunk resends the whole cleaned text every time
+        stream_deltas = bool(self.settings.get("streamDeltas"))
+        streamed = False
+        pending_ws = ""  # trailing whitespace held back until more text follows
+
+        # Sentences are synthesized by a consumer task, so TTS for sentence N
+        # overlaps streaming the LLM tokens that follow it
+        tts_q: asyncio.Queue = asyncio.Queue(maxsize=4)
+        queue_sentence = tts_q.put
+        tts_task = asyncio.create_task(self._tts_consumer(tts_q))
+
+        async def clean_chunks():
+            # Strip tags from each new chunk only; the first tag is the emotion.
+            # A "[" still open at the end of the reply was never a tag
+            async for chunk in ai.process_stream(input_text, session_id=self.session_id):
+                yield feed_tags(chunk)
+            yield tags.flush()
 
+        stream = clean_chunks()
         try:
-            async for chunk in ai.process_stream(input_text, session_id=self.session_id):
-                if self.tts_stop_event.is_set():
+            async for clean_chunk in stream:
+                if self._tts_stop:
                     break
 
-                full_response += chunk
-
-                # Detect emotion tag
-                if emotion == "NEUTRAL" and "[" in full_response and "]" in full_response:
-                    tag = re.search(r'\[(.*?)\]', full_response)
-                    if tag:
-                        emotion = tag.group(1)
-
-                # Stream cleaned text to FE
-                display = re.sub(r'\[.*?\]', '', full_response).strip()
-                if display and display != clean_so_far:
-                    clean_so_far = display
-                    await self._safe_send_json({
-                        "type": "ai_stream_chunk",
-                        "text": clean_so_far
-                    })
-
-                # Sentence splitting for TTS
-                sentence_buffer += chunk
-                sentences = re.split(r'(?<=[.!?])\s+', sentence_buffer)
-                if len(sentences) > 1:
-                    for s in sentences[:-1]:
-                        if s.strip():
-                            await self._send_tts(s)
-                    sentence_buffer = sentences[-1]
+                if not clean_chunk:
+                    continue
+
+                # Stream cleaned text to FE. Deltas concatenate to exactly the
+                # stripped text, so the legacy full text is built from them too
+                clean_parts.append(clean_chunk)
+                text = pending_ws + clean_chunk if streamed else clean_chunk.lstrip()
+                delta = text.rstrip()
+                pending_ws = text[len(delta):]
+                if delta:
+                    streamed = True
+                    if stream_deltas:
+                        await send({
+                            "type": "ai_stream_delta",
+                            "text": delta
+                        })
+                    else:
+                        clean_so_far += delta
+                        await send({
+                            "type": "ai_stream_chunk",
+                            "text": clean_so_far
+                        })
+
+                # Sentence splitting for TTS, on the cleaned text. The unflushed buffer
+                # holds no complete boundary, so only the new text (plus the char
+                # before it, for the lookbehind) needs scanning
+                scan_from = len(sentence_buffer)
+                sentence_buffer += clean_chunk
+                start = 0
+                for boundary in split_sentences(sentence_buffer, scan_from):
+                    s = sentence_buffer[start:boundary.start()]
+                    if s.strip():
+                        await queue_sentence(s)
+                    start = boundary.end()
+                if start:
+                    sentence_buffer = sentence_buffer[start:]
 
             # Flush remaining buffer
-            if sentence_buffer.strip() and not self.tts_stop_event.is_set():
-                await self._send_tts(sentence_buffer)
+            if sentence_buffer.strip() and not self._tts_stop:
+                await queue_sentence(sentence_buffer)
 
         except Exception as e:
-            logger.error(f"❌ AI/TTS pipeline error: {e}")
+            logger.error("❌ AI/TTS pipeline error: %s", e)
+        finally:
+            await stream.aclose()
+            # Finish the queued audio first: the FE attaches audio received so far
+            # to the message created by ai_response
+            await tts_q.put(None)
+            await tts_task
 
         # Final AI response
-        final_text = re.sub(r'\[.*?\]', '', full_response).strip()
+        final_text = "".join(clean_parts).strip()
         if final_text:
-            await self._safe_send_json({
+            await send({
                 "type": "ai_response",
                 "text": final_text,
-                "emotion": emotion
+                "emotion": tags.first_tag or "NEUTRAL"
             })
 
+    async def _tts_consumer(self, sentences: asyncio.Queue):
+        """Synthesize and send queued sentences in order, until the None sentinel"""
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                return
+            # Returns immediately once TTS has been stopped
+            await self._send_tts(sentence)
+
     async def _send_tts(self, text: str):
-        """Generate TTS for a sentence and send audio to FE"""
-        if self.tts_stop_event.is_set():
+        """Generate TTS for an already tag-free sentence and send audio to FE"""
+        if self._tts_stop:
             return
 
-        clean = re.sub(r'\[.*?\]', '', text).strip()
+        clean = text.strip()
         if not clean:
             return
 
+        tts = self.services["tts"]
+        cfg = self._tts_cfg
         try:
-            audio = await self.services["tts"].synthesize(
+            audio = await tts.synthesize(
                 clean,
-                audio_prompt=self.settings.get("ttsAudioPrompt"),
-                language=self.settings.get("ttsLanguage", "vi")
+                audio_prompt=cfg.prompt,
+                language=cfg.lang,
+                strip_tag=False,
             )
-            if audio and not self.tts_stop_event.is_set():
-                await self._safe_send_json({
-                    "type": "audio",
-                    "data": base64.b64encode(audio).decode("utf-8")
-                })
+            if audio and not self._tts_stop:
+                if cfg.binary:
+                    # Raw WAV in a binary frame: no base64 or JSON escaping
+                    await self._safe_send_binary(
+                        {"type": "audio_header", "mime": "audio/wav", "len": len(audio)},
+                        audio
+                    )
+                else:
+                    if len(audio) >= self.B64_THREAD_MIN:
+                        encoded = await asyncio.to_thread(_b64encode_to_str, audio)
+                    else:
+                        encoded = _b64encode_to_str(audio)
+                    await self._safe_send_json({
+                        "type": "audio",
+                        "data": encoded
+                    })
         except Exception as e:
-            logger.error(f"TTS error: {e}")
+            logger.error("TTS error: %s", e)
@@ -0,0 +1,84 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from services.ai import LLMAgent
+
+
+def _agent(monkeypatch, **env):
+    monkeypatch.setenv("LLM_API_KEY", "test-key")
+    monkeypatch.setenv("GOOGLE_API_KEY", "test-key")
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return LLMAgent()
+
+
+def test_prompt_cache_hints_off_by_default(monkeypatch):
+    monkeypatch.delenv("LLM_PROMPT_CACHE", raising=False)
+    assert _agent(monkeypatch)._cache_kwargs("s1") == {}
+
+
+def test_prompt_cache_hints_opt_in(monkeypatch):
+    agent = _agent(monkeypatch, LLM_PROMPT_CACHE="1")
+    assert agent._cache_kwargs("s1") == {
+        "user": "s1",
+        "extra_body": {"cache_prompt": True, "prompt_cache_key": "s1"},
+    }
+
+
+@pytest.mark.parametrize("setting", ["0", "1"])
+def test_prompt_cache_hints_never_sent_to_gemini(monkeypatch, setting):
+    agent = _agent(monkeypatch, LLM_PROMPT_CACHE=setting)
+    agent.update_model("gemini-2.0-flash")
+    assert agent._cache_kwargs("s1") == {}
+
+
+class _FakeCompletions:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    async def create(self, **kwargs):
+        async def stream():
+            for i, token in enumerate(self.tokens):
+                last = i == len(self.tokens) - 1
+                yield SimpleNamespace(choices=[SimpleNamespace(
+                    delta=SimpleNamespace(content=token),
+                    finish_reason="stop" if last else None,
+                )])
+        return stream()
+
+
+def _stream(agent, tokens):
+    agent.client = SimpleNamespace(chat=SimpleNamespace(completions=_FakeCompletions(tokens)))
+
+    async def run():
+        return [chunk async for chunk in agent.process_stream("hi", session_id="s1")]
+
+    return "".join(asyncio.run(run()))
+
+
+def _random_chunks(text, rng):
+    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(0, min(10, len(text) - 1))))
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+def test_process_stream_strips_leading_think_block(monkeypatch):
+    tokens = ["<thi", "nk>plan it</th", "ink>\n\n[HAPPY] Xin chào!"]
+    assert _stream(_agent(monkeypatch), tokens) == "[HAPPY] Xin chào!"
+
+
+def test_process_stream_strips_think_block_after_text(monkeypatch):
+    text = "[NEUTRAL] Ok. <think>secret reasoning</think>Done. a<b"
+    expected = "[NEUTRAL] Ok. Done. a<b"
+    agent = _agent(monkeypatch)
+    assert _stream(agent, list(text)) == expected
+    rng = random.Random(0)
+    for _ in range(100):
+        assert _stream(agent, _random_chunks(text, rng)) == expected
+
+
+def test_process_stream_keeps_text_that_only_looks_like_a_tag(monkeypatch):
+    assert _stream(_agent(monkeypatch), ["1 <", "thin", "g> 2 <thi"]) == "1 <thing> 2 <thi"
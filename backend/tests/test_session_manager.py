@@ -0,0 +1,188 @@
+import asyncio
+import base64
+import json
+import random
+
+from session_manager import SessionManager, _TagStripper
+
+
+def _strip(chunks):
+    tags = _TagStripper()
+    out = "".join(tags.feed(c) for c in chunks) + tags.flush()
+    return out, tags.first_tag
+
+
+def _random_chunks(text, rng):
+    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(0, min(8, len(text) - 1))))
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+def test_tag_stripper_removes_tags_across_chunks():
+    assert _strip(["[HAP", "PY] Xin ", "chào [", "x] bạn"]) == (" Xin chào  bạn", "HAPPY")
+
+
+def test_tag_stripper_keeps_unclosed_bracket_as_text():
+    rng = random.Random(0)
+    text = "Use [x for y. Then more."
+    for _ in range(200):
+        assert _strip(_random_chunks(text, rng)) == (text, None)
+
+
+def test_tag_stripper_bracket_ends_at_newline_or_length_limit():
+    assert _strip(["a [b\nc] d"]) == ("a [b\nc] d", None)
+    long = "[" + "x" * (_TagStripper.MAX_TAG_LEN + 1) + "] z"
+    assert _strip(list(long)) == (long, None)
+    assert _strip(["[x\n", "[SAD] ok"]) == ("[x\n ok", "SAD")
+
+
+class _FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        self.sent.append(bytes(data))
+
+
+class _FakeAI:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def process_stream(self, text, session_id=None):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class _FakeTTS:
+    def __init__(self):
+        self.spoken = []
+
+    async def synthesize(self, text, **kwargs):
+        self.spoken.append(text)
+        return b"RIFF"
+
+
+async def _drain(session):
+    # Let the writer task send everything queued before cleanup cancels it
+    while not session._tx_q.empty():
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+
+def _run_pipeline(chunks):
+    tts = _FakeTTS()
+    ws = _FakeWebSocket()
+
+    async def run():
+        session = SessionManager(ws, {"ai": _FakeAI(chunks), "stt": None, "tts": tts}, {})
+        await session.start()
+        await session._process_pipeline("hi")
+        await _drain(session)
+        await session.cleanup()
+
+    asyncio.run(run())
+    return tts.spoken, ws.sent
+
+
+def test_pipeline_speaks_sentences_after_unclosed_bracket():
+    rng = random.Random(1)
+    text = "Use [x for y. Then more."
+    for _ in range(50):
+        spoken, _ = _run_pipeline(_random_chunks(text, rng))
+        assert spoken == ["Use [x for y.", "Then more."]
+
+
+def test_pipeline_sentence_split_does_not_depend_on_chunking():
+    text = "Wait...   what?    Really."
+    expected = ["Wait...", "what?", "Really."]
+    assert _run_pipeline(list(text))[0] == expected
+    rng = random.Random(2)
+    for _ in range(200):
+        assert _run_pipeline(_random_chunks(text, rng))[0] == expected
+
+
+def _run_messages(messages, stt=None, **attrs):
+    ws = _FakeWebSocket()
+
+    async def run():
+        session = SessionManager(ws, {"ai": None, "stt": stt, "tts": None}, {})
+        for name, value in attrs.items():
+            setattr(session, name, value)
+        await session.start()
+        for message in messages:
+            await session.handle_message(message)
+        await _drain(session)
+        await session.cleanup()
+
+    asyncio.run(run())
+    return [json.loads(m) for m in ws.sent if isinstance(m, str)]
+
+
+def test_audio_limits_fit_in_default_ws_frame():
+    # uvicorn closes the socket on frames above ws_max_size (16 MiB by default)
+    assert SessionManager.MAX_AUDIO_B64_BYTES < 16 * 1024 * 1024
+
+
+def test_oversized_binary_audio_gets_error_reply():
+    sent = _run_messages(
+        [{"bytes": b"\0" * 600}, {"text": json.dumps({"type": "audio_end"})}],
+        MAX_AUDIO_BYTES=512,
+    )
+    assert sent[-1] == {"type": "stt_error", "message": "Audio too large"}
+
+
+def test_oversized_base64_audio_gets_error_reply():
+    message = {"type": "audio_complete", "data": "A" * 1024, "mimeType": "audio/webm"}
+    sent = _run_messages([{"text": json.dumps(message)}], MAX_AUDIO_B64_BYTES=512)
+    assert sent[-1] == {"type": "stt_error", "message": "Audio too large"}
+
+
+class _FakeSTT:
+    def __init__(self):
+        self.heard = []
+
+    async def transcribe(self, audio, mime_type):
+        self.heard.append(bytes(audio))
+        return ""
+
+
+def _audio_end():
+    return {"text": json.dumps({"type": "audio_end"})}
+
+
+def test_next_binary_upload_after_overflow_is_clean():
+    stt = _FakeSTT()
+    sent = _run_messages(
+        [{"bytes": b"\0" * 600}, _audio_end(), {"bytes": b"ok"}, _audio_end()],
+        stt=stt,
+        MAX_AUDIO_BYTES=512,
+    )
+    assert {"type": "stt_error", "message": "Audio too large"} in sent
+    assert stt.heard == [b"ok"]
+
+
+def test_base64_upload_discards_frames_without_audio_end():
+    stt = _FakeSTT()
+    message = {"type": "audio_complete", "data": base64.b64encode(b"new").decode()}
+    sent = _run_messages(
+        [{"bytes": b"\0" * 600}, {"text": json.dumps(message)}, _audio_end()],
+        stt=stt,
+        MAX_AUDIO_BYTES=512,
+    )
+    assert stt.heard == [b"new"]
+    assert all(m.get("type") != "stt_error" for m in sent)
+
+
+def test_cleanup_drops_pending_audio():
+    async def run():
+        session = SessionManager(_FakeWebSocket(), {"ai": None, "stt": None, "tts": None}, {})
+        session.MAX_AUDIO_BYTES = 512
+        await session.handle_message({"bytes": b"\0" * 600})
+        await session.handle_message({"bytes": b"\0" * 100})
+        await session.cleanup()
+        return session
+
+    session = asyncio.run(run())
+    assert not session._pending_audio and not session._pending_audio_overflow
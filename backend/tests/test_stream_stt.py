@@ -0,0 +1,126 @@
+import asyncio
+import contextlib
+import json
+import time
+import wave
+
+import pytest
+
+import services.stream_stt as stream_stt
+from services.stream_stt import StreamSTTService
+
+
+def _write_wav(path, samples=16000, rate=16000, channels=1):
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\1\0" * samples * channels)
+
+
+class _RecordingWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, frame):
+        self.frames.append(bytes(frame))
+
+
+class _FailingWebSocket:
+    async def send(self, frame):
+        raise ConnectionError("connection lost")
+
+
+def test_send_wav_mmap_streams_data_chunk(tmp_path):
+    path = tmp_path / "a.wav"
+    _write_wav(path)
+    ws = _RecordingWebSocket()
+    assert asyncio.run(StreamSTTService()._send_wav_mmap(ws, str(path)))
+    assert b"".join(ws.frames) == b"\1\0" * 16000
+
+
+def test_send_wav_mmap_rejects_other_formats(tmp_path):
+    path = tmp_path / "a.wav"
+    _write_wav(path, rate=8000)
+    ws = _RecordingWebSocket()
+    assert not asyncio.run(StreamSTTService()._send_wav_mmap(ws, str(path)))
+    assert ws.frames == []
+
+
+def test_send_wav_mmap_keeps_send_error(tmp_path):
+    path = tmp_path / "a.wav"
+    _write_wav(path)
+    with pytest.raises(ConnectionError):
+        asyncio.run(StreamSTTService()._send_wav_mmap(_FailingWebSocket(), str(path)))
+
+
+class _ScriptedServer:
+    """Replies to the Nth frame with the given messages, shortly after it is sent;
+    each send takes a while, like a real upload"""
+
+    def __init__(self, replies, delay=0.02, send_time=0.1):
+        self.replies = replies
+        self.delay = delay
+        self.send_time = send_time
+        self.sent = 0
+        self.inbox = asyncio.Queue()
+
+    async def send(self, frame):
+        await asyncio.sleep(self.send_time)
+        self.sent += 1
+        loop = asyncio.get_running_loop()
+        for message in self.replies.get(self.sent, ()):
+            loop.call_later(self.delay, self.inbox.put_nowait, message)
+
+    async def recv(self):
+        return await self.inbox.get()
+
+
+def _connect_to(monkeypatch, server):
+    @contextlib.asynccontextmanager
+    async def connect(uri, **kwargs):
+        yield server
+
+    monkeypatch.setattr(stream_stt.websockets, "connect", connect)
+
+
+def _partial(text, is_final=False):
+    return json.dumps({"text": text, "is_final": is_final})
+
+
+def test_transcribe_realtime_takes_first_result_after_send_as_final(monkeypatch):
+    frame = b"\0" * StreamSTTService().chunk_size * 2
+    _connect_to(monkeypatch, _ScriptedServer({1: [_partial("xin")], 2: [_partial("xin chào")]}))
+    seen = []
+
+    async def run():
+        start = time.monotonic()
+        text = await StreamSTTService().transcribe_realtime(
+            [frame, frame], on_partial_result=lambda t, f: seen.append((t, f))
+        )
+        return text, time.monotonic() - start
+
+    text, elapsed = asyncio.run(run())
+    assert text == "xin chào"
+    assert seen[-1] == ("xin chào", True)
+    # Returns on the final result, without waiting out a quiet window
+    assert elapsed < 1.0
+
+
+def test_transcribe_realtime_does_not_promote_a_partial(monkeypatch):
+    frame = b"\0" * StreamSTTService().chunk_size * 2
+    _connect_to(monkeypatch, _ScriptedServer({1: [_partial("xin")]}))
+
+    async def run():
+        service = StreamSTTService()
+        # The 2 s final-result wait is what this is about; shorten it
+        real = service._send_and_receive
+
+        async def quick(ws, send, on_message, final_timeout=3.0, on_final=None):
+            assert final_timeout == 2.0
+            await real(ws, send, on_message, 0.2, on_final)
+
+        service._send_and_receive = quick
+        return await service.transcribe_realtime([frame, frame])
+
+    assert asyncio.run(run()) == ""
@@ -0,0 +1,112 @@
+import asyncio
+import io
+import sys
+import wave
+from types import SimpleNamespace
+
+import pytest
+import websockets.exceptions
+
+import services.stt as stt
+from services.stt import pcm16_wav_data
+
+
+def _wav_bytes(samples=160, rate=16000, channels=1):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\0\0" * samples * channels)
+    return buf.getvalue()
+
+
+def test_pcm16_wav_data_locates_samples():
+    data = _wav_bytes()
+    assert pcm16_wav_data(data) == (44, 320)
+    # A data chunk size past the end (streamed WAVs) is clamped to what is there
+    assert pcm16_wav_data(data[:-20]) == (44, 300)
+
+
+def test_pcm16_wav_data_rejects_other_formats():
+    assert pcm16_wav_data(_wav_bytes(rate=8000)) is None
+    assert pcm16_wav_data(_wav_bytes(channels=2)) is None
+    assert pcm16_wav_data(b"OggS" + bytes(40)) is None
+
+
+def test_pcm16_wav_data_truncated_header():
+    data = _wav_bytes()
+    for cut in range(len(data[:44])):
+        assert pcm16_wav_data(data[:cut]) is None
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="ffmpeg pipes are not used on Windows")
+def test_ffmpeg_pipe_reaps_process_when_send_fails(tmp_path, monkeypatch):
+    # Stand-in for ffmpeg: echoes stdin as "PCM"; a short-lived child keeps
+    # stderr open past the kill, so the stderr reader outlives the process
+    fake = tmp_path / "ffmpeg"
+    fake.write_text("#!/bin/sh\nsleep 0.5 &\ncat\n")
+    fake.chmod(0o755)
+    monkeypatch.setattr(stt, "FFMPEG_EXE", str(fake))
+    procs = []
+    real_exec = asyncio.create_subprocess_exec
+
+    async def tracking_exec(*args, **kwargs):
+        procs.append(await real_exec(*args, **kwargs))
+        return procs[-1]
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", tracking_exec)
+
+    class ClosingWebSocket:
+        async def send(self, frame):
+            raise websockets.exceptions.ConnectionClosedError(None, None)
+
+        async def recv(self):
+            await asyncio.sleep(3600)
+
+    async def run():
+        with pytest.raises(websockets.exceptions.ConnectionClosed):
+            await stt.STTService()._ffmpeg_pipe_to_ws(b"\0" * 65536, ClosingWebSocket(), [])
+        # Checked straight away, before the loop gets another turn to tidy up
+        assert procs and procs[0].returncode is not None
+        pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        assert pending == []
+
+    asyncio.run(run())
+
+
+class _PooledWebSocket:
+    def __init__(self, queued):
+        self.inbox = asyncio.Queue()
+        for message in queued:
+            self.inbox.put_nowait(message)
+        self.state = SimpleNamespace(name="OPEN")
+
+    async def recv(self):
+        return await self.inbox.get()
+
+    async def close(self):
+        self.state.name = "CLOSED"
+
+
+def test_pool_drops_stale_results_before_reuse():
+    async def run():
+        pool = stt.STTConnectionPool(1)
+        ws = _PooledWebSocket(["late result 1", "late result 2"])
+        pool._idle.append(("wss://stt", ws))
+        async with pool.connection("wss://stt") as reused:
+            assert reused is ws
+            assert reused.inbox.empty()
+        assert pool._idle == [("wss://stt", ws)]
+
+    asyncio.run(run())
+
+
+def test_pool_size_setting(monkeypatch):
+    monkeypatch.delenv("STT_KEEPALIVE", raising=False)
+    monkeypatch.setenv("STT_POOL_SIZE", "3")
+    assert stt.STTService()._ws_pool.size == 3
+    monkeypatch.setenv("STT_POOL_SIZE", "0")
+    assert stt.STTService()._ws_pool is None
+    monkeypatch.setenv("STT_KEEPALIVE", "1")
+    assert stt.STTService()._ws_pool.size == 1
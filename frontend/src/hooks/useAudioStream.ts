@@ -3,6 +3,15 @@ import { Message, AppState, WebSocketMessage, Emotion } from '../types';
 import { SettingsData } from '../components/Settings';
 import { WS_CHAT_URL } from '../config/api';
 
+const arrayBufferToBase64 = (buffer: ArrayBuffer): string => {
+  const bytes = new Uint8Array(buffer);
+  let binary = '';
+  for (let i = 0; i < bytes.length; i += 0x8000) {
+    binary += String.fromCharCode(...bytes.subarray(i, i + 0x8000));
+  }
+  return window.btoa(binary);
+};
+
 export const useAudioStream = (settings?: SettingsData) => {
   const [isConnected, setIsConnected] = useState(false);
   const [appState, setAppState] = useState<AppState>('idle');
@@ -28,6 +37,7 @@ export const useAudioStream = (settings?: SettingsData) => {
   const [inputAnalyser, setInputAnalyser] = useState<AnalyserNode | null>(null);
   const [outputAnalyser, setOutputAnalyser] = useState<AnalyserNode | null>(null);
   const handleWebSocketMessageRef = useRef<(data: WebSocketMessage) => void | Promise<void>>(() => { });
+  const handleBinaryAudioRef = useRef<(buffer: ArrayBuffer) => void>(() => { });
   const lastVoiceActivityAtRef = useRef<number | null>(null);
   const didAutoStopSegmentRef = useRef(false);
 
@@ -63,6 +73,7 @@ export const useAudioStream = (settings?: SettingsData) => {
       }
 
       const socket = new WebSocket(WS_CHAT_URL);
+      socket.binaryType = 'arraybuffer';
 
       socket.onopen = () => {
         if (!isMounted) return;
@@ -71,6 +82,12 @@ export const useAudioStream = (settings?: SettingsData) => {
         setError(null);
         reconnectAttemptRef.current = 0;
         isConnectingRef.current = false;
+        // Ask for incremental ai_stream_delta messages instead of full-text ai_stream_chunk,
+        // and for TTS audio as raw binary frames instead of base64 JSON
+        socket.send(JSON.stringify({
+          type: 'update_settings',
+          settings: { streamDeltas: true, binaryAudio: true }
+        }));
       };
 
       socket.onclose = () => {
@@ -95,6 +112,11 @@ export const useAudioStream = (settings?: SettingsData) => {
 
       socket.onmessage = async (event) => {
         try {
+          if (event.data instanceof ArrayBuffer) {
+            // Binary frame = TTS audio announced by the preceding 'audio_header'
+            handleBinaryAudioRef.current(event.data);
+            return;
+          }
           const data: WebSocketMessage = JSON.parse(event.data);
           handleWebSocketMessageRef.current(data);
         } catch (e) {
@@ -167,6 +189,14 @@ export const useAudioStream = (settings?: SettingsData) => {
         }
         break;
 
+      case 'ai_stream_delta':
+        if (data.text) {
+          const delta = data.text;
+          setStreamingAiText((prev) => prev + delta);
+          setIsAiProcessing(false);
+        }
+        break;
+
       case 'ai_response':
         if (data.text) {
           const combinedAudio = currentAiAudioChunksRef.current.length > 0
@@ -194,6 +224,10 @@ export const useAudioStream = (settings?: SettingsData) => {
         }
         break;
 
+      case 'audio_header':
+        // The audio itself arrives in the next (binary) frame
+        break;
+
       case 'user_speaking':
         audioQueueRef.current = [];
         if (isPlayingRef.current) {
@@ -210,8 +244,15 @@ export const useAudioStream = (settings?: SettingsData) => {
     }
   };
 
+  const handleBinaryAudio = (buffer: ArrayBuffer) => {
+    // Keep a base64 copy for message playback; decodeAudioData detaches the buffer
+    currentAiAudioChunksRef.current.push(arrayBufferToBase64(buffer));
+    queueAudio(buffer);
+  };
+
   useEffect(() => {
     handleWebSocketMessageRef.current = handleWebSocketMessage;
+    handleBinaryAudioRef.current = handleBinaryAudio;
   });
 
   const addMessage = (type: 'user' | 'ai', text: string, audioData?: string) => {
@@ -307,19 +348,14 @@ export const useAudioStream = (settings?: SettingsData) => {
         const audioBlob = new Blob(chunks, { type: 'audio/webm' });
         console.log(`📦 Audio recorded: ${audioBlob.size} bytes, ${chunks.length} chunks`);
 
-        // Convert to base64 and send to backend as a complete audio message
-        const reader = new FileReader();
-        reader.readAsDataURL(audioBlob);
-        reader.onloadend = () => {
-          const base64Audio = (reader.result as string).split(',')[1];
-          if (socketRef.current?.readyState === WebSocket.OPEN) {
-            socketRef.current.send(JSON.stringify({
-              type: 'audio_complete',
-              data: base64Audio,
-              mimeType: 'audio/webm'
-            }));
-          }
-        };
+        // Send the raw blob as a binary frame, then mark the end of the utterance
+        if (socketRef.current?.readyState === WebSocket.OPEN) {
+          socketRef.current.send(audioBlob);
+          socketRef.current.send(JSON.stringify({
+            type: 'audio_end',
+            mimeType: 'audio/webm'
+          }));
+        }
       };
 
       mediaRecorder.start(100); // Collect chunks every 100ms (for visualization)
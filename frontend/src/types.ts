@@ -12,11 +12,13 @@ export type Emotion = 'HAPPY' | 'SAD' | 'NEUTRAL' | 'THINKING' | 'SURPRISED' | '
 export type AppState = 'idle' | 'listening' | 'processing' | 'speaking';
 
 export interface WebSocketMessage {
-  type: 'transcript' | 'ai_response' | 'ai_stream_chunk' | 'ai_processing' | 'audio' | 'recording_started' | 'recording_stopped' | 'error' | 'stt_error' | 'user_speaking';
+  type: 'transcript' | 'ai_response' | 'ai_stream_chunk' | 'ai_stream_delta' | 'ai_processing' | 'audio' | 'audio_header' | 'recording_started' | 'recording_stopped' | 'error' | 'stt_error' | 'user_speaking';
   text?: string;
   isFinal?: boolean;
   emotion?: Emotion;
   data?: string; // Base64 audio
+  mime?: string; // For audio_header type
+  len?: number; // For audio_header type: size of the binary frame that follows
   message?: string; // Error message
   isProcessing?: boolean; // For ai_processing type
 }